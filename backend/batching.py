@@ -0,0 +1,197 @@
+import asyncio
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from metrics import BATCH_SIZE, ERRORS, STAGE_SECONDS
+
+# Config
+MAX_BATCH_SIZE = int(os.environ.get("RETINET_MAX_BATCH_SIZE", 16))
+MAX_WAIT_MS = float(os.environ.get("RETINET_MAX_WAIT_MS", 10))
+MAX_PENDING = int(os.environ.get("RETINET_MAX_PENDING", 64))
+PREPROCESS_WORKERS = int(os.environ.get("RETINET_PREPROCESS_WORKERS", 2))
+
+class EngineOverloaded(Exception):
+    """Raised when the engine already holds `max_pending` requests."""
+
+class BatchInferenceEngine:
+    """
+    Collects concurrent inference requests into micro-batches.
+
+    Each caller awaits `submit(item)`. A single background task drains the queue,
+    waiting at most `max_wait_ms` after the first item for more work (or until
+    `max_batch_size` items are pending), then calls `predict_fn(items)` once and
+    hands each caller its own result.
+
+    None of the CPU-bound work runs on the event loop: `infer()` decodes and
+    preprocesses in a small thread pool, and every forward pass runs on a single
+    dedicated thread (torch's own intra-op threads parallelise inside it).
+    At most `max_pending` requests are admitted at once; beyond that `infer()`
+    raises EngineOverloaded so the API can shed load instead of queueing forever.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_pending=MAX_PENDING, preprocess_workers=PREPROCESS_WORKERS):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.max_pending = max(1, int(max_pending))
+        self.preprocess_workers = max(1, int(preprocess_workers))
+        self.queue = None
+        self._task = None
+        self.preprocess_executor = None
+        self.forward_executor = None
+        self.pending = 0
+        self._capacity = None
+
+        # Stats
+        self.batches_run = 0
+        self.items_processed = 0
+        self.batch_size_histogram = Counter()
+        self.total_batch_seconds = 0.0
+        self.total_queue_wait_seconds = 0.0
+        self.rejected = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running:
+            return
+        self.queue = asyncio.Queue()
+        self._capacity = asyncio.Condition()
+        self.preprocess_executor = ThreadPoolExecutor(self.preprocess_workers, thread_name_prefix="retinet-preprocess")
+        self.forward_executor = ThreadPoolExecutor(1, thread_name_prefix="retinet-forward")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        # Fail anything still waiting so no request hangs on shutdown
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference engine stopped"))
+
+        self.preprocess_executor.shutdown(wait=False)
+        self.forward_executor.shutdown(wait=True)
+
+    async def run_on_forward_thread(self, fn, *args):
+        """Runs `fn` on the forward thread, serialised with the batches (used for model warm-up)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.forward_executor, fn, *args)
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_pending
+
+    async def infer(self, preprocess_fn, *args, wait=False):
+        """
+        Admits one request, runs `preprocess_fn(*args)` off the event loop and
+        submits the result for batched prediction. When the engine is saturated,
+        interactive callers are rejected; bulk callers pass `wait=True` to queue for a slot.
+        """
+        if self.saturated:
+            if not wait:
+                self.rejected += 1
+                raise EngineOverloaded(f"{self.pending} requests already pending")
+            async with self._capacity:
+                await self._capacity.wait_for(lambda: not self.saturated)
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            item = await loop.run_in_executor(self.preprocess_executor, preprocess_fn, *args)
+            return await self.submit(item)
+        finally:
+            self.pending -= 1
+            async with self._capacity:
+                self._capacity.notify()
+
+    async def submit(self, item):
+        if not self.running:
+            raise RuntimeError("Inference engine is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued before waiting for stragglers
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+
+            # Drop requests whose callers already went away (client disconnects)
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = await self._predict([item for item, _, _ in batch])
+            except Exception as e:
+                ERRORS.inc(stage="batch")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+            finished = time.perf_counter()
+            self.batches_run += 1
+            self.items_processed += len(batch)
+            self.batch_size_histogram[len(batch)] += 1
+            self.total_batch_seconds += finished - started
+            self.total_queue_wait_seconds += sum(started - enqueued for _, _, enqueued in batch)
+
+            BATCH_SIZE.observe(len(batch))
+            STAGE_SECONDS.observe(finished - started, stage="batch")
+            for _, _, enqueued in batch:
+                STAGE_SECONDS.observe(started - enqueued, stage="queue_wait")
+
+    async def _predict(self, items):
+        return await self.run_on_forward_thread(self.predict_fn, items)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_run": self.batches_run,
+            "items_processed": self.items_processed,
+            "avg_batch_size": (self.items_processed / self.batches_run) if self.batches_run else 0.0,
+            "avg_batch_ms": (self.total_batch_seconds / self.batches_run * 1000.0) if self.batches_run else 0.0,
+            "avg_queue_wait_ms": (self.total_queue_wait_seconds / self.items_processed * 1000.0) if self.items_processed else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_histogram.items())},
+        }
@@ -0,0 +1,82 @@
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+
+# Config
+RESULTS_DIR = "bench/results"
+
+def summarize(samples):
+    """Latency summary of a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        # Nearest-rank, so p99 of a short run is an observed latency rather than an interpolation
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))] * 1000.0
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000.0,
+        "p50_ms": percentile(50),
+        "p95_ms": percentile(95),
+        "p99_ms": percentile(99),
+        "max_ms": ordered[-1] * 1000.0,
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def environment():
+    """Everything needed to tell whether two result files are comparable."""
+    return {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "env": {key: value for key, value in sorted(os.environ.items()) if key.startswith("RETINET_")},
+    }
+
+def save_results(kind, results, output=None):
+    """Writes results plus the environment to JSON (default: bench/results/<kind>_<commit>_<time>.json)."""
+    payload = {"kind": kind, "environment": environment(), **results}
+    if output is None:
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{kind}_{payload['environment']['commit']}_{stamp}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(payload, f, indent=2)
+    print(f"💾 Results saved to {output}")
+    return output
+
+def _flatten(node, prefix=""):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from _flatten(value, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+def compare(results, baseline_path):
+    """Prints latency and throughput changes against an earlier result file of the same kind."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    before = dict(_flatten({key: value for key, value in baseline.items() if key not in ("environment", "config")}))
+    after = dict(_flatten({key: value for key, value in results.items() if key not in ("environment", "config")}))
+
+    print(f"📊 Compared with {baseline_path} (commit {baseline.get('environment', {}).get('commit', '?')})")
+    for key, value in after.items():
+        if key not in before or not (key.endswith(("p50_ms", "p95_ms", "p99_ms")) or key.endswith("_per_s")):
+            continue
+        old = before[key]
+        change = (value - old) / old * 100.0 if old else 0.0
+        # Lower is better for latencies, higher for throughput
+        worse = change > 0 if key.endswith("_ms") else change < 0
+        marker = "⚠️" if worse and abs(change) >= 10 else "  "
+        print(f"{marker} {key:<48}{old:>12.2f} -> {value:>10.2f}  ({change:+.1f}%)")
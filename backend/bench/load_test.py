@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import contextlib
+import glob
+import os
+import random
+import sys
+import time
+from collections import Counter
+import httpx
+
+# Run from backend/ like ml/train.py; make the serving modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.common import compare, save_results, summarize
+
+# Config
+IMAGE_DIR = "uploads"
+ENDPOINTS = ("analyze", "history", "patients", "report")
+DEFAULT_MIX = "analyze=4,history=3,patients=2,report=1"
+PAGE_LIMIT = 20
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise SystemExit(f"❌ Unknown endpoint '{name}' in --mix. Choose from: {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def load_images(image_dir):
+    paths = sorted(path for ext in ("jpg", "jpeg", "png") for path in glob.glob(os.path.join(image_dir, f"*.{ext}")))
+    if not paths:
+        raise SystemExit(f"❌ No sample images found in {image_dir}")
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append((os.path.basename(path), f.read()))
+    return images
+
+class LoadTest:
+    """Closed-loop load: `concurrency` workers each send their next request as soon as the last one returns."""
+
+    def __init__(self, client, images, mix, unique_uploads=False, patients=50):
+        self.client = client
+        self.images = images
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.unique_uploads = unique_uploads
+        self.patients = patients
+        self.scan_ids = []
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.statuses = {name: Counter() for name in ENDPOINTS}
+        self.errors = Counter()
+
+    def _upload(self):
+        filename, data = random.choice(self.images)
+        if self.unique_uploads:
+            # Bytes after the image's end marker change its content hash (no result-cache hit) but not its pixels
+            data = data + os.urandom(16)
+        patient = random.randrange(self.patients)
+        return {"file": (filename, data, "image/jpeg")}, {"patient_name": f"Bench Patient {patient}", "mobile_number": f"900{patient:07d}"}
+
+    async def request(self, name):
+        if name == "report" and not self.scan_ids:
+            name = "history"  # Nothing to report on yet
+
+        started = time.perf_counter()
+        if name == "analyze":
+            files, data = self._upload()
+            response = await self.client.post("/analyze", files=files, data=data)
+        elif name == "history":
+            response = await self.client.get("/history", params={"limit": PAGE_LIMIT})
+        elif name == "patients":
+            response = await self.client.get("/patients", params={"limit": PAGE_LIMIT})
+        else:
+            response = await self.client.get(f"/report/{random.choice(self.scan_ids)}")
+        elapsed = time.perf_counter() - started
+
+        # /analyze reports internal failures as 200 {"status": "error"}
+        ok = response.status_code < 400 and not (name == "analyze" and response.json().get("status") != "success")
+        if name == "history" and ok:
+            self.scan_ids = [scan["_id"] for scan in response.json()] or self.scan_ids
+        return name, elapsed, response.status_code, ok
+
+    async def seed(self, count):
+        """Gives /history, /patients and /report data to read before measuring."""
+        for _ in range(count):
+            await self.request("analyze")
+        await self.request("history")
+
+    async def run(self, concurrency, duration):
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = random.choices(self.names, self.weights)[0]
+                try:
+                    name, elapsed, status, ok = await self.request(name)
+                except httpx.HTTPError as e:
+                    self.errors[name] += 1
+                    self.statuses[name][type(e).__name__] += 1
+                    continue
+                self.statuses[name][str(status)] += 1
+                if ok:
+                    self.latencies[name].append(elapsed)
+                else:
+                    self.errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - started
+
+    def results(self, elapsed):
+        endpoints = {}
+        for name in ENDPOINTS:
+            if not self.statuses[name]:
+                continue
+            endpoints[name] = {
+                **summarize(self.latencies[name]),
+                "errors": self.errors[name],
+                "statuses": dict(self.statuses[name]),
+                "requests_per_s": len(self.latencies[name]) / elapsed,
+            }
+        all_latencies = [sample for samples in self.latencies.values() for sample in samples]
+        return {
+            "elapsed_seconds": elapsed,
+            "total": {**summarize(all_latencies), "errors": sum(self.errors.values()), "requests_per_s": len(all_latencies) / elapsed},
+            "endpoints": endpoints,
+        }
+
+def upload_tree(directory):
+    """Every file and subdirectory under `directory` (flat or RETINET_SHARDED_UPLOADS layout)."""
+    files, dirs = set(), set()
+    for root, subdirs, filenames in os.walk(directory):
+        files.update(os.path.join(root, name) for name in filenames)
+        dirs.update(os.path.join(root, name) for name in subdirs)
+    return files, dirs
+
+@contextlib.asynccontextmanager
+async def in_process_client():
+    """The real app (model, batching engine, report workers) against mongomock, through httpx's ASGI transport."""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise SystemExit("❌ In-process mode needs mongomock-motor (pip install mongomock-motor). Or pass --url to test a running server.")
+    import main
+
+    db = AsyncMongoMockClient().retinet_db
+    main.collection_scans = db.scans
+    main.collection_patients = db.patients
+    main.collection_result_cache = db.result_cache
+    if main.result_cache.collection is not None:
+        main.result_cache.collection = db.result_cache
+
+    existing_files, existing_dirs = upload_tree(main.UPLOAD_DIR)
+    try:
+        async with main.app.router.lifespan_context(main.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=120) as client:
+                yield client
+    finally:
+        # Scans only lived in mongomock; drop the uploads they stored (and shard dirs they created)
+        files, dirs = upload_tree(main.UPLOAD_DIR)
+        for path in files - existing_files:
+            os.remove(path)
+        for path in sorted(dirs - existing_dirs, key=len, reverse=True):
+            os.rmdir(path)
+
+async def wait_until_ready(client, timeout=300):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        with contextlib.suppress(httpx.HTTPError):
+            if (await client.get("/ready")).status_code == 200:
+                return
+        await asyncio.sleep(0.5)
+    raise SystemExit("❌ Backend did not become ready (GET /ready)")
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    images = load_images(args.images)
+    random.seed(args.seed)
+
+    if args.url:
+        client_context = httpx.AsyncClient(base_url=args.url, timeout=120, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        client_context = in_process_client()
+
+    async with client_context as client:
+        await wait_until_ready(client)
+        test = LoadTest(client, images, mix, args.unique_uploads, args.patients)
+        print(f"🌱 Seeding {args.seed_scans} scans...")
+        await test.seed(args.seed_scans)
+        # Measure only the timed run
+        test.latencies = {name: [] for name in ENDPOINTS}
+        test.statuses = {name: Counter() for name in ENDPOINTS}
+        test.errors.clear()
+
+        print(f"🚀 {args.concurrency} concurrent clients for {args.duration:.0f}s ({args.mix})...")
+        elapsed = await test.run(args.concurrency, args.duration)
+
+    results = test.results(elapsed)
+    print(f"{'endpoint':<10}{'ok':>8}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in {**results["endpoints"], "total": results["total"]}.items():
+        print(f"{name:<10}{row.get('count', 0):>8}{row['errors']:>8}{row['requests_per_s']:>10.1f}"
+              f"{row.get('p50_ms', 0):>10.1f}{row.get('p95_ms', 0):>10.1f}{row.get('p99_ms', 0):>10.1f}")
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    config["target"] = args.url or "in-process (mongomock)"
+    save_results("load", {"config": config, **results}, args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test /analyze, /history, /patients and /report/{scan_id}.")
+    parser.add_argument("--url", default=None, help="Running backend to test (default: in-process app on mongomock)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Relative request weights per endpoint")
+    parser.add_argument("--images", default=IMAGE_DIR, help="Directory of sample fundus images")
+    parser.add_argument("--unique-uploads", action="store_true", help="Make every upload a new image (measures the model, not the result cache)")
+    parser.add_argument("--patients", type=int, default=50, help="Distinct mobile numbers uploads are spread across")
+    parser.add_argument("--seed-scans", type=int, default=10, help="Scans uploaded before measuring")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the request mix")
+    parser.add_argument("--output", default=None, help="Result JSON path (default: bench/results/load_<commit>_<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to diff against")
+    asyncio.run(run(parser.parse_args()))
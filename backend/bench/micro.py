@@ -0,0 +1,123 @@
+import argparse
+import datetime
+import glob
+import itertools
+import os
+import sys
+import time
+import torch
+from PIL import Image
+
+# Run from backend/ like ml/train.py; make the serving modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench.common import compare, save_results, summarize
+from inference import TORCH_THREADS, WEIGHTS_PATHS, configure_torch_threads, load_and_preprocess, transform_pipeline
+from model_backends import ARTIFACT_DIR, ARTIFACT_FILES, BACKENDS, MULTITASK_BACKENDS, load_backend
+from reports import render_report
+
+# Config
+IMAGE_DIR = "uploads"
+BATCH_SIZES = "1,4,16"
+
+def time_calls(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def bench_preprocess(paths, iterations, warmup):
+    """transform_pipeline on already-decoded images, and the full decode + transform done per upload."""
+    decoded = []
+    for path in paths:
+        with Image.open(path) as image:
+            decoded.append(image.convert("RGB"))
+
+    results = {}
+    for name, fn, inputs in [("transform", transform_pipeline, decoded), ("decode_transform", load_and_preprocess, paths)]:
+        source = itertools.cycle(inputs)
+        samples = time_calls(lambda: fn(next(source)), iterations, warmup)
+        summary = summarize(samples)
+        results[name] = {**summary, "images_per_s": 1000.0 / summary["mean_ms"]}
+        print(f"⏱️ {name}: p50 {summary['p50_ms']:.2f} ms, {results[name]['images_per_s']:.0f} img/s")
+    return results
+
+def bench_forward(backends, batch_sizes, arch, weights_path, threads, iterations, warmup):
+    device = torch.device("cpu")
+    results = {}
+    for name in backends:
+        # load_backend quietly serves eager fp32 when an artifact hasn't been exported; record that
+        fallback = (arch == "multitask" and name not in MULTITASK_BACKENDS) or (
+            name in ARTIFACT_FILES and not os.path.exists(os.path.join(ARTIFACT_DIR, ARTIFACT_FILES[name])))
+        runner = load_backend(name, weights_path, device, threads, arch)
+        results[name] = {"fallback_to_eager": fallback}
+        for size in batch_sizes:
+            batch = torch.randn(size, 3, 224, 224)
+            with torch.no_grad():
+                samples = time_calls(lambda: runner(batch), iterations, warmup)
+            summary = summarize(samples)
+            results[name][str(size)] = {**summary, "images_per_s": size * 1000.0 / summary["mean_ms"]}
+            print(f"⏱️ forward {name} bs={size}: p50 {summary['p50_ms']:.1f} ms, {results[name][str(size)]['images_per_s']:.1f} img/s")
+        del runner
+    return results
+
+def bench_pdf(image_path, iterations, warmup):
+    scan = {
+        "_id": "bench",
+        "patient_id": "P-BENCH",
+        "patient_name": "Bench Patient",
+        "timestamp": datetime.datetime(2024, 1, 1, 9, 30),
+        "diagnosis": "Moderate",
+        "confidence": 0.87,
+        "biological_age": 54,
+        "cardiovascular_risk": "Moderate",
+        # draw_report resolves this back to the local file, as it does for stored scans
+        "file_url": f"http://localhost:8000/{image_path.replace(os.sep, '/')}",
+    }
+    size = len(render_report(scan))
+    summary = summarize(time_calls(lambda: render_report(scan), iterations, warmup))
+    print(f"⏱️ PDF render: p50 {summary['p50_ms']:.1f} ms ({size / 1024:.0f} KB)")
+    return {**summary, "reports_per_s": 1000.0 / summary["mean_ms"], "size_bytes": size}
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks: preprocessing, forward pass per backend and batch size, PDF rendering.")
+    parser.add_argument("--only", default="preprocess,forward,pdf", help="Comma-separated subset of benchmarks to run")
+    parser.add_argument("--images", default=IMAGE_DIR, help="Directory of sample fundus images")
+    parser.add_argument("--backends", default="eager,int8_dynamic", help=f"Any of: {', '.join(BACKENDS)}")
+    parser.add_argument("--batch-sizes", default=BATCH_SIZES)
+    parser.add_argument("--arch", choices=list(WEIGHTS_PATHS), default="resnet18")
+    parser.add_argument("--weights", default=None, help="Default: the served weights file for --arch")
+    parser.add_argument("--threads", type=int, default=TORCH_THREADS, help="torch intra-op threads")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default=None, help="Result JSON path (default: bench/results/micro_<commit>_<time>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result JSON to diff against")
+    args = parser.parse_args()
+
+    selected = {name.strip() for name in args.only.split(",")}
+    paths = sorted(path for ext in ("jpg", "jpeg", "png") for path in glob.glob(os.path.join(args.images, f"*.{ext}")))
+    if not paths and selected & {"preprocess", "pdf"}:
+        raise SystemExit(f"❌ No sample images found in {args.images}")
+    configure_torch_threads(args.threads)
+
+    results = {}
+    if "preprocess" in selected:
+        results["preprocess"] = bench_preprocess(paths, args.iterations, args.warmup)
+    if "forward" in selected:
+        batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+        backends = [name.strip() for name in args.backends.split(",")]
+        results["forward"] = bench_forward(backends, batch_sizes, args.arch, args.weights or WEIGHTS_PATHS[args.arch],
+                                           args.threads, args.iterations, args.warmup)
+    if "pdf" in selected:
+        results["pdf"] = bench_pdf(paths[0], args.iterations, args.warmup)
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    save_results("micro", {"config": config, **results}, args.output)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
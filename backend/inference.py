@@ -0,0 +1,252 @@
+import os
+import time
+import hashlib
+import torch
+from torchvision import transforms
+from PIL import Image
+from model_backends import ARTIFACT_DIR, CPU_ONLY_BACKENDS, load_backend
+from metrics import profile_if_sampled, time_stage
+from model_registry import ModelRegistry
+from similarity import EMBEDDINGS_ENABLED
+from quality import QUALITY_GATE, check_quality, measure as measure_quality
+from ml.vision_transformer import HEADS
+
+# Global Model (replaced as a whole by activate(); readers take the reference once per batch)
+served = None
+model = None
+model_version = None
+registry = ModelRegistry()
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+# resnet18 (DR grade only) | multitask (RetiNetModel: DR, diseases, biological age, cardio risk)
+MODEL_ARCH = os.environ.get("RETINET_MODEL_ARCH", "resnet18")
+WEIGHTS_PATHS = {
+    "resnet18": "ml/models/retinet_v1.pth",
+    "multitask": "ml/models/retinet_mt.pth",
+}
+WEIGHTS_PATH = WEIGHTS_PATHS.get(MODEL_ARCH, WEIGHTS_PATHS["resnet18"])
+# eager | int8_dynamic | int8_static | torchscript | compile | onnx (see model_backends.py)
+INFERENCE_BACKEND = os.environ.get("RETINET_BACKEND", "eager")
+if INFERENCE_BACKEND in CPU_ONLY_BACKENDS:
+    device = torch.device("cpu")
+WARMUP_BATCH_SIZES = [int(size) for size in os.environ.get("RETINET_WARMUP_BATCH_SIZES", "").split(",") if size.strip()]
+WARMUP_ITERATIONS = int(os.environ.get("RETINET_WARMUP_ITERATIONS", 2))
+# Heads run when a request doesn't choose; fewer heads = less work per scan on the multi-task model
+DEFAULT_HEADS = tuple(head for head in os.environ.get("RETINET_DEFAULT_HEADS", ",".join(HEADS)).split(",") if head in HEADS)
+DISEASE_THRESHOLD = float(os.environ.get("RETINET_DISEASE_THRESHOLD", 0.5))
+# Intra-op threads for the forward pass; leave cores free for decode workers and the event loop
+TORCH_THREADS = int(os.environ.get("RETINET_TORCH_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+
+def configure_torch_threads(num_threads=TORCH_THREADS):
+    torch.set_num_threads(num_threads)
+    try:
+        # Batches are already serialised on one thread, inter-op parallelism only oversubscribes
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Can only be set once per process, before any parallel work
+
+def weights_fingerprint(path):
+    """Short content hash of a weights file ("imagenet" when untrained weights are used)."""
+    if not os.path.exists(path):
+        return "imagenet"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+class ServedModel:
+    """A loaded backend and what it can produce. Never mutated, so swapping models is one assignment."""
+
+    def __init__(self, runner, arch, version, registry_version=None):
+        self.runner = runner
+        self.arch = arch
+        self.version = version
+        self.registry_version = registry_version
+        self.heads = HEADS if arch == "multitask" else ("dr_grade",)
+
+def load_model(arch=MODEL_ARCH, weights_path=None, registry_version=None, artifact_dir=ARTIFACT_DIR, backbone=None):
+    """Loads a backend without touching the one being served."""
+    weights_path = weights_path or WEIGHTS_PATHS.get(arch, WEIGHTS_PATH)
+    print(f"🔄 Loading AI Model on {device}...")
+    runner = load_backend(INFERENCE_BACKEND, weights_path, device, TORCH_THREADS, arch, artifact_dir, backbone)
+    arch_tag = "-mt" if arch == "multitask" else ""
+    # Registry versions default to the same weights hash, so cache entries survive registering the current model
+    version = f"{registry_version or weights_fingerprint(weights_path)}{arch_tag}-{INFERENCE_BACKEND}"
+    return ServedModel(runner, arch, version, registry_version)
+
+def load_registry_model(version):
+    meta = registry.get(version)
+    if meta is None:
+        raise KeyError(f"Unknown model version '{version}'")
+    return load_model(meta["arch"], registry.weights_path(version), version, registry.version_dir(version), meta.get("backbone"))
+
+def load_startup_model():
+    """The registry's ACTIVE version when there is one, else the weights file for RETINET_MODEL_ARCH."""
+    active = registry.active_version()
+    if active:
+        return load_registry_model(active)
+    return load_model()
+
+def activate(new_model):
+    """Makes `new_model` the one new batches use; a batch already running keeps its reference."""
+    global served, model, model_version
+    served = new_model
+    model = new_model.runner
+    model_version = new_model.version
+
+def get_served():
+    """Returns the served model, loading it on first use."""
+    if served is None:
+        activate(load_startup_model())
+    return served
+
+def get_model():
+    return get_served().runner
+
+# Result keys produced by each head
+RESULT_KEYS = {
+    "dr_grade": ("dr_grade", "confidence"),
+    "diseases": ("diseases",),
+    "biological_age": ("biological_age",),
+    "cardio_risk": ("cardio_risk",),
+}
+
+def resolve_heads(requested=None):
+    """
+    Parses a comma-separated head list from a request. The DR head always runs (every scan
+    record needs a grade); heads the served model doesn't have are dropped.
+    """
+    current = served
+    served_heads = current.heads if current is not None else HEADS
+    if not requested:
+        names = set(DEFAULT_HEADS)
+    else:
+        names = {name.strip() for name in requested.split(",") if name.strip()}
+        unknown = names - set(HEADS)
+        if unknown:
+            raise ValueError(f"Unknown heads: {', '.join(sorted(unknown))}. Choose from: {', '.join(HEADS)}")
+    names.add("dr_grade")
+    return tuple(head for head in HEADS if head in names and head in served_heads)
+
+def has_heads(result, heads):
+    return all(key in result for head in heads for key in RESULT_KEYS[head])
+
+def select_heads(result, heads):
+    keys = {"model_version", "embedding"} | {key for head in heads for key in RESULT_KEYS[head]}
+    return {key: value for key, value in result.items() if key in keys}
+
+# Preprocessing
+transform_pipeline = transforms.Compose([
+    transforms.Resize(256),
+    transforms.CenterCrop(224),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+])
+
+DR_LABELS = {
+    0: "No DR (Normal)",
+    1: "Mild",
+    2: "Moderate",
+    3: "Severe",
+    4: "Proliferative DR"
+}
+
+# Smallest decode that still covers the Resize(256) step
+DECODE_SIZE = 256
+
+def load_and_preprocess(path, quality_check=False):
+    """
+    Decodes an image file and returns the (3, 224, 224) model input. With `quality_check`,
+    raises quality.ImageQualityError first for images that aren't worth a forward pass.
+    """
+    with time_stage("decode"), Image.open(path) as image:
+        # JPEG only: let libjpeg decode at a 1/2-1/8 DCT scale instead of full resolution
+        image.draft("RGB", (DECODE_SIZE, DECODE_SIZE))
+        rgb = image.convert("RGB")
+    if quality_check:
+        with time_stage("quality"):
+            measurements = measure_quality(rgb)
+        check_quality(measurements)
+    with time_stage("transform"):
+        return transform_pipeline(rgb)
+
+def predict_batch(tensors, heads=None, served_model=None):
+    """
+    Runs one forward pass over a list of preprocessed (3, 224, 224) tensors.
+    Returns one result dict per input, in input order, with the RESULT_KEYS of `heads`
+    (default: every served head) and the model_version that produced it, plus a unit-length
+    float16 "embedding" when the backend exposes its penultimate layer (EMBEDDINGS_ENABLED).
+    """
+    # One reference for the whole batch, so a concurrent swap can't mix models
+    current = served_model or get_served()
+    ai_model = current.runner
+    heads = [head for head in HEADS if head in (heads or current.heads) and head in current.heads]
+    input_tensor = torch.stack(tensors).to(device)
+
+    with torch.no_grad():
+        with time_stage("forward"), profile_if_sampled("forward"):
+            if current.arch == "multitask":
+                # Shared backbone runs once; unrequested heads are skipped entirely
+                outputs = ai_model(input_tensor, heads=heads, return_features=EMBEDDINGS_ENABLED)
+            elif EMBEDDINGS_ENABLED and hasattr(ai_model, "forward_head"):
+                # Same ops as forward(), split at the pooled features (exported graphs only give logits)
+                features = ai_model.forward_head(ai_model.forward_features(input_tensor), pre_logits=True)
+                outputs = {"dr_grade": ai_model.get_classifier()(features), "embedding": features}
+            else:
+                outputs = {"dr_grade": ai_model(input_tensor)}
+
+        # Single host transfer per head for the whole batch instead of .item() per row
+        results = [{"model_version": current.version} for _ in tensors]
+        if "dr_grade" in outputs:
+            probabilities = torch.nn.functional.softmax(outputs["dr_grade"].float(), dim=1)
+            confidence, predicted_class = torch.max(probabilities, 1)
+            for result, grade, conf in zip(results, predicted_class.tolist(), confidence.tolist()):
+                result["dr_grade"] = grade
+                result["confidence"] = conf
+        if "diseases" in outputs:
+            for result, row in zip(results, torch.sigmoid(outputs["diseases"].float()).tolist()):
+                result["diseases"] = [[label, prob] for label, prob in enumerate(row) if prob >= DISEASE_THRESHOLD]
+        if "biological_age" in outputs:
+            for result, age in zip(results, outputs["biological_age"].float().squeeze(1).tolist()):
+                result["biological_age"] = age
+        if "cardio_risk" in outputs:
+            for result, risk in zip(results, torch.sigmoid(outputs["cardio_risk"].float()).squeeze(1).tolist()):
+                result["cardio_risk"] = risk
+        if "embedding" in outputs:
+            # Unit length, so similarity search is a dot product; float16 halves the store
+            embeddings = torch.nn.functional.normalize(outputs["embedding"].float(), dim=1).half().cpu().numpy()
+            for result, embedding in zip(results, embeddings):
+                result["embedding"] = embedding
+
+    return results
+
+def load_request(path, heads):
+    """Preprocess step for the batching engine: pairs the decoded input with the heads its caller wants."""
+    return load_and_preprocess(path, QUALITY_GATE), heads
+
+def predict_requests(items):
+    """
+    Batched entry point for the inference engine, over (tensor, heads) pairs.
+    The batch runs the union of requested heads once; each caller gets back only its own.
+    """
+    union = set().union(*(heads for _, heads in items))
+    results = predict_batch([tensor for tensor, _ in items], union)
+    return [select_heads(result, heads) for result, (_, heads) in zip(results, items)]
+
+def warm_up(batch_sizes, iterations=WARMUP_ITERATIONS, served_model=None):
+    """
+    Loads the model (or takes `served_model`, e.g. one about to be swapped in) and runs dummy
+    batches so allocator pools and kernels are initialised before the first patient scan.
+    Returns the last latency per batch size in ms.
+    """
+    served_model = served_model or get_served()
+    timings = {}
+    for size in batch_sizes:
+        dummy = [torch.zeros(3, 224, 224)] * size
+        for _ in range(max(1, iterations)):
+            started = time.perf_counter()
+            predict_batch(dummy, served_model=served_model)
+            timings[size] = (time.perf_counter() - started) * 1000.0
+    print(f"🔥 Warm-up complete: {', '.join(f'bs={size} {ms:.1f}ms' for size, ms in timings.items())}")
+    return timings
@@ -1,18 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Query, Response, Header, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-import shutil
 import os
-import torch
-import timm
 import random
-from torchvision import transforms
-from PIL import Image
 import io
 import uuid
 import datetime
+import asyncio
+import base64
+import csv
+import json
+import time
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
 from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse, JSONResponse
+from starlette.background import BackgroundTask
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from collections import Counter, deque
+import inference
+from inference import DR_LABELS, WARMUP_BATCH_SIZES, WARMUP_ITERATIONS, configure_torch_threads, has_heads, load_request, predict_requests, resolve_heads, select_heads, warm_up
+from batching import BatchInferenceEngine, EngineOverloaded
+from quality import ImageQualityError
+from metrics import CACHE_LOOKUPS, ERRORS, PENDING, QUEUE_DEPTH, REJECTED, REQUEST_SECONDS, logger, render as render_metrics, time_stage
+from similarity import EMBEDDINGS_ENABLED, get_index as get_embedding_index
+from result_cache import ResultCache, CACHE_USE_MONGO
+from reports import REPORT_FIELDS, ReportCache, ZipStream, render_report, render_merged_report, report_etag, report_filename
+from storage import UPLOAD_DIR, UPLOAD_TMP_DIR, MAX_ARCHIVE_BYTES, UploadTooLarge, derivative_name, discard_upload, make_derivatives, save_upload, stream_to_temp, extract_archive_images
 
 app = FastAPI(title="RetiNet Pro API", version="1.0.0")
 
@@ -23,11 +43,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Serve Uploads for History View
-os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+@app.middleware("http")
+async def record_request_latency(request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Route template, not the raw path, so /report/{scan_id} stays one series
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - started,
+        route=route.path if route is not None else "unmatched",
+        method=request.method,
+        status=response.status_code,
+    )
+    return response
+
+class ImmutableStaticFiles(StaticFiles):
+    """Stored images are named by content hash and never rewritten, so browsers may keep them indefinitely."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+# Serve Uploads (originals and their WebP thumb/medium derivatives) for History View
+app.mount("/uploads", ImmutableStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 # MongoDB Connection
 MONGO_URL = "mongodb://localhost:27017" # Replace with your URI if needed
@@ -35,331 +77,923 @@ client = AsyncIOMotorClient(MONGO_URL)
 db = client.retinet_db
 collection_scans = db.scans
 collection_patients = db.patients
+collection_result_cache = db.result_cache
+
+# Repeat uploads of the same image skip the model (keyed by content hash + model version)
+result_cache = ResultCache(collection=collection_result_cache if CACHE_USE_MONGO else None)
+
+# Inference Engine (micro-batches concurrent /analyze calls into one forward pass)
+inference_engine = BatchInferenceEngine(predict_requests)
+RETRY_AFTER_SECONDS = int(os.environ.get("RETINET_RETRY_AFTER_SECONDS", 2))
+BATCH_INSERT_SIZE = int(os.environ.get("RETINET_BATCH_INSERT_SIZE", 100))
+
+# Readiness (flipped once the model is loaded and warmed up)
+model_status = {"ready": False, "detail": "Loading model"}
+background_tasks = set()
+
+# Model registry (ml/models/registry): swaps load and warm in the background, then switch between batches
+REGISTRY_POLL_SECONDS = float(os.environ.get("RETINET_REGISTRY_POLL_SECONDS", 10))
+model_swap_lock = asyncio.Lock()
+
+def warm_up_batch_sizes():
+    # Default to the smallest and largest batch the engine will actually run
+    return WARMUP_BATCH_SIZES or sorted({1, inference_engine.max_batch_size})
 
-# Global Model
-model = None
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-def get_model():
-    global model
-    if model is None:
-        print(f"🔄 Loading AI Model on {device}...")
-        model = timm.create_model('resnet18', pretrained=True, num_classes=5)
-        
-        weights_path = "ml/models/retinet_v1.pth"
-        if os.path.exists(weights_path):
-            model.load_state_dict(torch.load(weights_path, map_location=device))
-            print("✅ Trained Model Loaded Successfully!")
-        else:
-            print("⚠️ Warning: Trained weights not found. Running with pre-trained ImageNet weights.")
-            
-        model.to(device)
-        model.eval()
-    return model
-
-# Preprocessing
-transform_pipeline = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
-
-DR_LABELS = {
-    0: "No DR (Normal)",
-    1: "Mild",
-    2: "Moderate",
-    3: "Severe",
-    4: "Proliferative DR"
-}
-
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-
-# ... (imports)
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def warm_up_model():
+    try:
+        timings = await inference_engine.run_on_forward_thread(warm_up, warm_up_batch_sizes())
+        await result_cache.set_model_version(inference.model_version)
+        model_status.update(ready=True, detail="Ready", model_version=inference.model_version, warmup_ms=timings)
+    except Exception as e:
+        ERRORS.inc(stage="warmup")
+        logger.exception("Model warm-up failed")
+        model_status.update(ready=False, detail=f"Warm-up failed: {e}")
+
+async def swap_model(version):
+    """
+    Loads and warms a registry version next to the serving model (off the forward thread,
+    so scans keep flowing), then swaps it in between two batches and marks it ACTIVE.
+    """
+    async with model_swap_lock:
+        model_status["swap"] = {"version": version, "state": "loading"}
+        try:
+            new_model = await asyncio.to_thread(inference.load_registry_model, version)
+            model_status["swap"]["state"] = "warming"
+            timings = await asyncio.to_thread(warm_up, warm_up_batch_sizes(), WARMUP_ITERATIONS, new_model)
+
+            # The forward thread runs one batch at a time: the batch in flight finishes on the old model
+            await inference_engine.run_on_forward_thread(inference.activate, new_model)
+            await result_cache.set_model_version(new_model.version)
+            await asyncio.to_thread(inference.registry.set_active, version)
+
+            model_status.update(model_version=new_model.version, warmup_ms=timings)
+            model_status["swap"] = {"version": version, "state": "active"}
+            print(f"✅ Now serving model {new_model.version}")
+        except Exception as e:
+            ERRORS.inc(stage="model_swap")
+            logger.exception("Swapping to model version %s failed", version)
+            model_status["swap"] = {"version": version, "state": "failed", "error": str(e)}
+
+async def watch_registry():
+    """Follows registry/ACTIVE, so every worker swaps when it changes (API call or 'model_registry.py activate')."""
+    while True:
+        await asyncio.sleep(REGISTRY_POLL_SECONDS)
+        try:
+            active = await asyncio.to_thread(inference.registry.active_version)
+        except OSError:
+            continue
+        current = inference.served
+        last_swap = model_status.get("swap") or {}
+        if (not active or current is None or not model_status["ready"] or model_swap_lock.locked()
+                or active == current.registry_version
+                or (last_swap.get("version") == active and last_swap.get("state") == "failed")):
+            continue
+        await swap_model(active)
+
+async def ensure_indexes():
+    await collection_scans.create_index("mobile_number")
+    await collection_scans.create_index("patient_id")
+    # Keyset pagination sorts on (timestamp, _id); these also serve the grade and patient filters
+    await collection_scans.create_index([("timestamp", -1), ("_id", -1)])
+    await collection_scans.create_index([("patient_id", 1), ("timestamp", -1), ("_id", -1)])
+    await collection_scans.create_index([("dr_grade", 1), ("timestamp", -1), ("_id", -1)])
+    await collection_patients.create_index("mobile_number", unique=True)
+    await collection_patients.create_index("patient_id", unique=True)
+    await collection_patients.create_index([("last_scan", -1), ("_id", -1)])
+
+async def backfill_patients():
+    """One-off migration: build the patients collection from scans recorded before it existed."""
+    if await collection_patients.estimated_document_count() > 0:
+        return
+    pipeline = [
+        {"$match": {"mobile_number": {"$nin": [None, "Unknown"]}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": "$mobile_number",
+            "patient_id": {"$first": "$patient_id"},
+            "name": {"$last": "$patient_name"},
+            "created_at": {"$min": "$timestamp"},
+            "last_scan": {"$max": "$timestamp"},
+            "latest_diagnosis": {"$last": "$diagnosis"},
+            "scan_count": {"$sum": 1}
+        }}
+    ]
+    summaries = await collection_scans.aggregate(pipeline, allowDiskUse=True).to_list(None)
+    if summaries:
+        # Legacy scans may have no patient_id, or share one across mobiles: those patients get a fresh
+        # id, and their scans are re-pointed to it
+        missing = {p["_id"] for p in summaries if not p.get("patient_id")}
+        updates = {p.pop("_id"): {"$setOnInsert": {**p, "patient_id": p.get("patient_id") or new_patient_id()}} for p in summaries}
+        renumbered = missing | await upsert_patients(updates)
+        async for patient in collection_patients.find({"mobile_number": {"$in": list(renumbered)}}, {"mobile_number": 1, "patient_id": 1}):
+            await collection_scans.update_many({"mobile_number": patient["mobile_number"]}, {"$set": {"patient_id": patient["patient_id"]}})
+        print(f"🗂️ Backfilled {len(summaries)} patients from existing scans")
+
+@app.on_event("startup")
+async def prepare_database():
+    try:
+        await ensure_indexes()
+        await backfill_patients()
+    except Exception:
+        ERRORS.inc(stage="database_setup")
+        logger.exception("Database setup failed")
+
+@app.on_event("startup")
+async def start_inference_engine():
+    configure_torch_threads()
+    await inference_engine.start()
+    await result_cache.create_indexes()
+    # Load and warm in the background so the server can already answer /ready with 503
+    run_in_background(warm_up_model())
+    if REGISTRY_POLL_SECONDS > 0:
+        run_in_background(watch_registry())
+
+@app.on_event("shutdown")
+async def stop_inference_engine():
+    await inference_engine.stop()
+
+async def score_image(image_hash, file_path, heads, wait=False):
+    """
+    Returns the model outputs for `heads` (see inference.predict_batch), from the result
+    cache when this image was already scored with those heads.
+    """
+    with time_stage("cache_lookup"):
+        cached = await result_cache.get(image_hash)
+    if cached and has_heads(cached, heads):
+        return select_heads(cached, heads)
+
+    result = await inference_engine.infer(load_request, file_path, heads, wait=wait)
+    # Keep heads scored earlier so a later request for them is still a hit; the embedding
+    # lives in the similarity index instead (and isn't JSON/BSON-serialisable)
+    await result_cache.put(image_hash, {**(cached or {}), **{key: value for key, value in result.items() if key != "embedding"}})
+    return result
+
+def cardio_risk_label(score):
+    if score >= 0.66:
+        return "High"
+    return "Moderate" if score >= 0.33 else "Low"
+
+UNKNOWN_PATIENT = "Unknown Patient"
+
+def new_patient_id():
+    # 10 hex digits: collisions stay rare at millions of patients (and are retried, see upsert_patients)
+    return f"P-{uuid.uuid4().hex[:10].upper()}"
+
+PATIENT_WRITE_ATTEMPTS = 3
+
+def is_patient_id_conflict(error):
+    """Whether a duplicate-key error (DuplicateKeyError.details or a bulk writeError) is on patient_id rather than mobile_number."""
+    if error.get("keyPattern"):
+        return "patient_id" in error["keyPattern"]
+    return "patient_id" in error.get("errmsg", "")  # Older servers only describe the key in the message
+
+def patient_update(record, scan_count=1):
+    """
+    Counts scans against a patient (keyed by mobile number), creating it on the first stored scan.
+    The form/manifest default name never overwrites a real one.
+    """
+    on_insert = {"patient_id": record["patient_id"] or new_patient_id(), "created_at": record["timestamp"]}
+    update = {"$setOnInsert": on_insert, "$max": {"last_scan": record["timestamp"]}, "$inc": {"scan_count": scan_count}}
+    if record["patient_name"] == UNKNOWN_PATIENT:
+        on_insert["name"] = record["patient_name"]
+    else:
+        update["$set"] = {"name": record["patient_name"]}
+    return update
+
+def latest_diagnosis_update(record):
+    """
+    (filter, update) setting the patient's diagnosis from `record` only if it is their newest
+    scan; run after patient_update, whose $max has already taken this scan's timestamp into account.
+    """
+    return (
+        {"mobile_number": record["mobile_number"], "last_scan": {"$lte": record["timestamp"]}},
+        {"$set": {"latest_diagnosis": record["diagnosis"]}},
+    )
+
+async def upsert_patient(scan_record):
+    """Counts a scan against its patient (one atomic upsert, then the newest-scan diagnosis) and returns the patient_id."""
+    if scan_record["mobile_number"] == "Unknown":
+        return new_patient_id()
+
+    for attempt in range(PATIENT_WRITE_ATTEMPTS):
+        try:
+            patient = await collection_patients.find_one_and_update(
+                {"mobile_number": scan_record["mobile_number"]},
+                patient_update(scan_record),
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            break
+        except DuplicateKeyError:
+            # Either another first scan for this mobile won the race (the retry matches it),
+            # or the new patient_id is taken (the retry draws another)
+            if attempt == PATIENT_WRITE_ATTEMPTS - 1:
+                raise
+    await collection_patients.update_one(*latest_diagnosis_update(scan_record))
+    return patient["patient_id"]
+
+async def patient_ids_for(mobile_numbers):
+    """
+    {mobile_number: patient_id} for a batch: existing patients' ids, and fresh ones for new
+    mobiles. Nothing is written here; record_patient_scans creates patients as their scans are stored.
+    """
+    if not mobile_numbers:
+        return {}
+    cursor = collection_patients.find({"mobile_number": {"$in": list(mobile_numbers)}}, {"mobile_number": 1, "patient_id": 1})
+    existing = {patient["mobile_number"]: patient["patient_id"] async for patient in cursor}
+    return {mobile_number: existing.get(mobile_number) or new_patient_id() for mobile_number in mobile_numbers}
+
+async def upsert_patients(updates):
+    """
+    Bulk-upserts {mobile_number: update} (updates carry a $setOnInsert patient_id), retrying
+    duplicate-key conflicts: a patient created concurrently for the same mobile is matched
+    on retry, and a patient_id that is already taken is replaced with a new one. Returns the
+    mobile numbers that conflicted, whose patient may not have the patient_id they were given.
+    """
+    pending, conflicted = list(updates), set()
+    for attempt in range(PATIENT_WRITE_ATTEMPTS):
+        try:
+            await collection_patients.bulk_write(
+                [UpdateOne({"mobile_number": mobile_number}, updates[mobile_number], upsert=True) for mobile_number in pending],
+                ordered=False)
+            return conflicted
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if attempt == PATIENT_WRITE_ATTEMPTS - 1 or any(error["code"] != 11000 for error in errors):
+                raise
+            # Only the failed writes were not applied, so only they are retried
+            pending = [pending[error["index"]] for error in errors]
+            conflicted.update(pending)
+            for error, mobile_number in zip(errors, pending):
+                if is_patient_id_conflict(error):
+                    updates[mobile_number]["$setOnInsert"]["patient_id"] = new_patient_id()
+
+async def record_patient_scans(scan_records):
+    """
+    Applies the patient summary updates for a chunk of stored scans in two bulk writes.
+    Returns {mobile_number: patient_id} for patients that ended up with another id than
+    their scans were stored with (the scans are re-pointed to it).
+    """
+    counts, latest = Counter(), {}
+    for record in scan_records:
+        mobile_number = record["mobile_number"]
+        if mobile_number == "Unknown":
+            continue
+        counts[mobile_number] += 1
+        if mobile_number not in latest or record["timestamp"] >= latest[mobile_number]["timestamp"]:
+            latest[mobile_number] = record
+    if not latest:
+        return {}
+
+    conflicted = await upsert_patients({mobile_number: patient_update(record, counts[mobile_number]) for mobile_number, record in latest.items()})
+    reassigned = {}
+    async for patient in collection_patients.find({"mobile_number": {"$in": list(conflicted)}}, {"mobile_number": 1, "patient_id": 1}):
+        stored_id = latest[patient["mobile_number"]]["patient_id"]
+        if patient["patient_id"] != stored_id:
+            reassigned[patient["mobile_number"]] = patient["patient_id"]
+            await collection_scans.update_many(
+                {"patient_id": stored_id, "mobile_number": patient["mobile_number"]},
+                {"$set": {"patient_id": patient["patient_id"]}})
+
+    await collection_patients.bulk_write([UpdateOne(*latest_diagnosis_update(record)) for record in latest.values()], ordered=False)
+    return reassigned
+
+def create_derivatives(filenames):
+    """Background task: thumbnail/medium WebPs for History previews (failures only cost the preview)."""
+    for filename in filenames:
+        try:
+            with time_stage("derivatives"):
+                make_derivatives(filename)
+        except Exception:
+            logger.exception("Could not create derivatives of %s", filename)
+
+async def discard_rejected_upload(unique_filename):
+    """
+    Deletes the stored original of an upload the quality gate rejected. Uploads are stored by
+    content hash, so a file an earlier scan already points to is kept; identical bytes always
+    get the same verdict, so no scan can come to need a rejected file.
+    """
+    file_url = f"http://localhost:8000/uploads/{unique_filename}"
+    if not await collection_scans.count_documents({"file_url": file_url}, limit=1):
+        await asyncio.to_thread(discard_upload, unique_filename)
+
+def index_embeddings(items):
+    """
+    Background task: adds (scan_id, image_hash, model_version, embedding) items to the
+    similar-scan index. A cache hit has no embedding; the image's earlier one is reused.
+    """
+    for scan_id, image_hash, model_version, embedding in items:
+        try:
+            with time_stage("embedding_index"):
+                index = get_embedding_index(model_version, None if embedding is None else len(embedding))
+                if index is not None and embedding is None:
+                    embedding = index.vector_for_hash(image_hash)
+                if embedding is not None:
+                    index.add(scan_id, image_hash, embedding)
+        except Exception:
+            logger.exception("Could not index the embedding of scan %s", scan_id)
+
+def build_scan_record(patient_name, mobile_number, unique_filename, result, served_heads, patient_id=None):
+    """
+    The stored scan. Age and cardio risk fall back to the legacy DR-based heuristics only when
+    the served model (`served_heads`) has no such head; a head the request skipped is left out.
+    """
+    clean_class = result["dr_grade"]
+    scan_record = {
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "mobile_number": mobile_number,
+        "timestamp": datetime.datetime.now(),
+        "file_url": f"http://localhost:8000/uploads/{unique_filename}",
+        "thumb_url": f"http://localhost:8000/uploads/{derivative_name(unique_filename, 'thumb')}",
+        "medium_url": f"http://localhost:8000/uploads/{derivative_name(unique_filename, 'medium')}",
+        "diagnosis": DR_LABELS[clean_class],
+        "dr_grade": clean_class,
+        "confidence": result["confidence"],
+        "model_version": result.get("model_version")
+    }
+    if "biological_age" in result:
+        scan_record["biological_age"] = round(result["biological_age"])
+    elif "biological_age" not in served_heads:
+        scan_record["biological_age"] = random.randint(30, 75) # Heuristic without the age head
+    if "cardio_risk" in result:
+        scan_record["cardiovascular_risk"] = cardio_risk_label(result["cardio_risk"])
+        scan_record["cardio_risk_score"] = result["cardio_risk"]
+    elif "cardio_risk" not in served_heads:
+        scan_record["cardiovascular_risk"] = "Moderate" if clean_class > 2 else "Low"
+    if "diseases" in result:
+        scan_record["findings"] = result["diseases"]
+    return scan_record
+
+def format_results(scan_record):
+    clean_class = scan_record["dr_grade"]
+    return {
+        "diabetic_retinopathy": {
+            "grade": DR_LABELS[clean_class],
+            "confidence": float(f"{scan_record['confidence']:.4f}"),
+            "is_normal": clean_class == 0
+        },
+        "biological_age": {
+            "predicted": scan_record.get("biological_age"),  # None when the request skipped the head
+            "gap": 0
+        },
+        "cardiovascular_risk": scan_record.get("cardiovascular_risk"),
+        "diseases_found": [DR_LABELS[clean_class]] if clean_class > 0 else [],
+        # Multi-label disease head (class index, probability), only when that head ran
+        "other_findings": [{"class": label, "probability": float(f"{prob:.4f}")} for label, prob in scan_record.get("findings", [])]
+    }
 
 @app.post("/analyze")
 async def analyze_scan(
+    tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    patient_name: str = Form("Unknown Patient"),
-    mobile_number: str = Form("Unknown")
+    patient_name: str = Form(UNKNOWN_PATIENT),
+    mobile_number: str = Form("Unknown"),
+    heads: str = Form(None)
 ):
+    # Shed load before reading the upload if the inference queue is already full
+    if inference_engine.saturated:
+        REJECTED.inc()
+        raise HTTPException(status_code=503, detail="Inference queue is full, retry shortly", headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
     try:
-        # 1. Save File
-        unique_filename = f"{uuid.uuid4()}_{file.filename}"
-        file_path = f"uploads/{unique_filename}"
-        
-        contents = await file.read()
-        
-        with open(file_path, "wb") as f:
-            f.write(contents)
-            
-        # 2. AI Inference
-        ai_model = get_model()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-        input_tensor = transform_pipeline(image).unsqueeze(0).to(device)
-        
-        with torch.no_grad():
-            outputs = ai_model(input_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            confidence, predicted_class = torch.max(probabilities, 1)
-            
-            clean_class = predicted_class.item()
-            clean_conf = confidence.item()
-
-        # 3. Store in MongoDB
-        # Generate a patient ID based on mobile number if possible, or random
-        patient_id = f"P-{str(uuid.uuid4())[:6].upper()}"
-        if mobile_number != "Unknown":
-            # Check if patient exists to reuse ID (Simple logic)
-            existing_patient = await collection_scans.find_one({"mobile_number": mobile_number})
-            if existing_patient:
-                patient_id = existing_patient["patient_id"]
-
-        scan_record = {
-            "patient_id": patient_id, 
-            "patient_name": patient_name,
-            "mobile_number": mobile_number,
-            "timestamp": datetime.datetime.now(),
-            "file_url": f"http://localhost:8000/uploads/{unique_filename}",
-            "diagnosis": DR_LABELS[clean_class],
-            "dr_grade": clean_class,
-            "confidence": clean_conf,
-            "biological_age": random.randint(30, 75), # Heuristic for now
-            "cardiovascular_risk": "Moderate" if clean_class > 2 else "Low"
-        }
-        
-        await collection_scans.insert_one(scan_record)
+        requested_heads = resolve_heads(heads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    unique_filename = None
+    try:
+        # 1. Save File (streamed in chunks, named by content hash so re-uploads are stored once)
+        with time_stage("upload"):
+            image_hash, unique_filename = await save_upload(file)
+        file_path = os.path.join(UPLOAD_DIR, unique_filename)
+
+        # 2. AI Inference (cached per image + model version; otherwise decoded off the event loop and batched)
+        result = await score_image(image_hash, file_path, requested_heads)
+
+        # 3. Store in MongoDB (patient summary is upserted first so the scan carries its patient_id)
+        scan_record = build_scan_record(patient_name, mobile_number, unique_filename, result, inference.get_served().heads)
+        with time_stage("mongo_patient_upsert"):
+            scan_record["patient_id"] = await upsert_patient(scan_record)
+        with time_stage("mongo_insert"):
+            await collection_scans.insert_one(scan_record)
+        # History previews and the similarity index are updated after the response is sent
+        tasks.add_task(create_derivatives, [unique_filename])
+        if EMBEDDINGS_ENABLED:
+            tasks.add_task(index_embeddings, [(str(scan_record["_id"]), image_hash, scan_record["model_version"], result.get("embedding"))])
 
         # 4. Return Result
         return {
             "status": "success",
             "file_url": scan_record["file_url"],
-            "results": {
-                "diabetic_retinopathy": {
-                    "grade": DR_LABELS[clean_class],
-                    "confidence": float(f"{clean_conf:.4f}"),
-                    "is_normal": clean_class == 0
-                },
-                "biological_age": {
-                    "predicted": scan_record["biological_age"],
-                    "gap": 0
-                },
-                "cardiovascular_risk": scan_record["cardiovascular_risk"],
-                "diseases_found": [DR_LABELS[clean_class]] if clean_class > 0 else []
-            }
+            "results": format_results(scan_record)
         }
+    except EngineOverloaded:
+        REJECTED.inc()
+        raise HTTPException(status_code=503, detail="Inference queue is full, retry shortly", headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageQualityError as e:
+        # Rejected before the model ran; nothing is stored as a scan, nor kept in uploads/
+        await discard_rejected_upload(unique_filename)
+        raise HTTPException(status_code=422, detail={"reason": e.reason, "message": str(e)})
     except Exception as e:
-        print(f"Error: {e}")
+        ERRORS.inc(stage="analyze")
+        logger.exception("Analyze failed for %s", file.filename)
         return {"status": "error", "message": str(e)}
 
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from fastapi.responses import Response
-from bson import ObjectId
+def read_batch_manifest(contents):
+    """Parses a screening-camp CSV (filename, patient_name, mobile_number) into {basename: (name, mobile)}."""
+    reader = csv.DictReader(io.StringIO(contents.decode("utf-8-sig")))
+    manifest = {}
+    for row in reader:
+        row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+        if row.get("filename"):
+            manifest[os.path.basename(row["filename"])] = (
+                row.get("patient_name") or UNKNOWN_PATIENT,
+                row.get("mobile_number") or "Unknown",
+            )
+    return manifest
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(None),
+    archive: UploadFile = File(None),
+    manifest: UploadFile = File(None),
+    heads: str = Form(None)
+):
+    """
+    Grades many scans in one call. Accepts several `files`, or a zip `archive`, plus an
+    optional CSV `manifest` (filename, patient_name, mobile_number). Results stream back as
+    NDJSON, one line per image as it completes, followed by a summary line.
+    """
+    try:
+        requested_heads = resolve_heads(heads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 1. Ingest everything to disk first (uploads are only valid until the handler returns)
+    images, skipped = [], []
+    try:
+        for upload in files or []:
+            image_hash, unique_filename = await save_upload(upload)
+            images.append((os.path.basename(upload.filename or unique_filename), image_hash, unique_filename))
+
+        if archive is not None:
+            archive_path, _ = await stream_to_temp(archive, MAX_ARCHIVE_BYTES)
+            try:
+                stored, skipped = await asyncio.to_thread(extract_archive_images, archive_path)
+            finally:
+                await asyncio.to_thread(os.remove, archive_path)
+            images.extend(stored)
+
+        patients = read_batch_manifest(await manifest.read()) if manifest is not None else {}
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except (zipfile.BadZipFile, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch upload: {e}")
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found in the upload")
+
+    stored_files = []  # Originals of stored scans, which get WebP derivatives once the stream ends
+
+    async def stream_results():
+        started = time.perf_counter()
+        pending_records = []
+        embeddings = {}  # scan _id -> index_embeddings item, indexed once the scan is stored
+        record_files = {}  # scan _id -> stored original
+        succeeded = failed = rejected = 0
+
+        # Resolve every known patient in the batch up front (one round trip); new ones are created with their first stored scan
+        patient_ids = await patient_ids_for({mobile_number for _, mobile_number in patients.values() if mobile_number != "Unknown"})
+
+        for name, reason in skipped:
+            yield json.dumps({"status": "skipped", "filename": name, "message": reason}) + "\n"
+
+        async def process(index, filename, image_hash, unique_filename):
+            try:
+                patient_name, mobile_number = patients.get(filename, (UNKNOWN_PATIENT, "Unknown"))
+                result = await score_image(image_hash, os.path.join(UPLOAD_DIR, unique_filename), requested_heads, wait=True)
+                patient_id = patient_ids.get(mobile_number) or new_patient_id()
+                scan_record = build_scan_record(patient_name, mobile_number, unique_filename, result, inference.get_served().heads, patient_id)
+                scan_record["_id"] = ObjectId()
+                embeddings[scan_record["_id"]] = (str(scan_record["_id"]), image_hash, scan_record["model_version"], result.get("embedding"))
+                record_files[scan_record["_id"]] = unique_filename
+                return index, filename, scan_record, None
+            except ImageQualityError as e:
+                return index, filename, None, e
+            except Exception as e:
+                ERRORS.inc(stage="analyze_batch")
+                logger.exception("Batch scan failed for %s", filename)
+                return index, filename, None, e
+
+        async def flush():
+            # Bulk insert instead of one round trip per scan
+            records = pending_records[:]
+            pending_records.clear()
+            stored = [embeddings.pop(record["_id"]) for record in records]
+            files = [record_files.pop(record["_id"]) for record in records]
+            try:
+                with time_stage("mongo_insert"):
+                    await collection_scans.insert_many(records, ordered=False)
+                    stored_files.extend(files)
+                    # Later scans of a patient whose id changed on insert use the stored one
+                    patient_ids.update(await record_patient_scans(records))
+                if EMBEDDINGS_ENABLED:
+                    await asyncio.to_thread(index_embeddings, stored)
+                return None
+            except Exception as e:
+                logger.exception("Batch insert of %d scans failed", len(records))
+                return json.dumps({"status": "error", "message": f"Failed to store {len(records)} scans: {e}"}) + "\n"
+
+        # 2. Keep a bounded window of images in flight so the engine can form full batches
+        window = max(1, min(2 * inference_engine.max_batch_size, inference_engine.max_pending // 2))
+        queue = iter(enumerate(images))
+        in_flight = set()
+
+        def refill():
+            for index, (filename, image_hash, unique_filename) in queue:
+                in_flight.add(asyncio.ensure_future(process(index, filename, image_hash, unique_filename)))
+                if len(in_flight) >= window:
+                    break
+
+        refill()
+        try:
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.difference_update(done)
+                refill()
+
+                for task in done:
+                    index, filename, scan_record, error = task.result()
+                    if isinstance(error, ImageQualityError):
+                        rejected += 1
+                        await discard_rejected_upload(images[index][2])
+                        yield json.dumps({"status": "rejected", "index": index, "filename": filename, "reason": error.reason, "message": str(error)}) + "\n"
+                        continue
+                    if error is not None:
+                        failed += 1
+                        yield json.dumps({"status": "error", "index": index, "filename": filename, "message": str(error)}) + "\n"
+                        continue
+
+                    succeeded += 1
+                    pending_records.append(scan_record)
+                    yield json.dumps({
+                        "status": "success",
+                        "index": index,
+                        "filename": filename,
+                        "scan_id": str(scan_record["_id"]),
+                        "patient_id": scan_record["patient_id"],
+                        "file_url": scan_record["file_url"],
+                        "results": format_results(scan_record),
+                    }) + "\n"
+
+                if len(pending_records) >= BATCH_INSERT_SIZE:
+                    error_line = await flush()
+                    if error_line:
+                        yield error_line
+
+            if pending_records:
+                error_line = await flush()
+                if error_line:
+                    yield error_line
+        finally:
+            # Client went away mid-stream: stop scoring the rest
+            for task in in_flight:
+                task.cancel()
+
+        elapsed = time.perf_counter() - started
+        yield json.dumps({
+            "status": "complete",
+            "total": len(images),
+            "succeeded": succeeded,
+            "failed": failed,
+            "rejected": rejected,
+            "skipped": len(skipped),
+            "elapsed_seconds": round(elapsed, 3),
+            "images_per_second": round(succeeded / elapsed, 2) if elapsed else None,
+        }) + "\n"
+
+    return StreamingResponse(
+        stream_results(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(create_derivatives, stored_files),
+    )
+
+# Reports render in separate processes: ReportLab is pure Python and would otherwise hold the GIL
+REPORT_WORKERS = int(os.environ.get("RETINET_REPORT_WORKERS", 2))
+report_executor = None
+report_cache = ReportCache()
+
+@app.on_event("startup")
+async def start_report_workers():
+    global report_executor
+    # spawn, not fork: the parent already runs torch and executor threads
+    report_executor = ProcessPoolExecutor(REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+@app.on_event("shutdown")
+async def stop_report_workers():
+    if report_executor is not None:
+        report_executor.shutdown(wait=False, cancel_futures=True)
+
+REPORT_PROJECTION = {field: 1 for field in REPORT_FIELDS}
+
+async def get_report_pdf(scan, remember=True):
+    """Returns (etag, pdf bytes), rendering in the worker pool only on a cache miss."""
+    etag = report_etag(scan)
+    pdf = report_cache.get(etag)
+    if pdf is None:
+        loop = asyncio.get_running_loop()
+        with time_stage("report_render"):
+            pdf = await loop.run_in_executor(report_executor, render_report, scan)
+        if remember:
+            report_cache.put(etag, pdf)
+    return etag, pdf
 
 @app.get("/report/{scan_id}")
-async def generate_report(scan_id: str):
-    import textwrap  # Import locally to ensure availability
+async def generate_report(scan_id: str, if_none_match: str = Header(None)):
     try:
-        # Fetch Scan
-        scan = await collection_scans.find_one({"_id": ObjectId(scan_id)})
+        # Fetch Scan (only the fields that are rendered)
+        with time_stage("mongo_find"):
+            scan = await collection_scans.find_one({"_id": ObjectId(scan_id)}, REPORT_PROJECTION)
         if not scan:
             raise HTTPException(status_code=404, detail="Scan not found")
 
-        # Create PDF in Memory
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-
-        # --- Header ---
-        c.setFillColorRGB(0.06, 0.3, 0.27) # Medical Teal
-        c.rect(0, height - 100, width, 100, fill=True, stroke=False)
-        
-        c.setFillColorRGB(1, 1, 1) # White
-        c.setFont("Helvetica-Bold", 24)
-        c.drawString(50, height - 60, "RetiNet Pro")
-        c.setFont("Helvetica", 12)
-        c.drawString(50, height - 80, "Clinical Diagnostic Report")
-
-        # --- Patient Info ---
-        c.setFillColorRGB(0, 0, 0) # Black
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, height - 140, "Patient Details")
-        
-        c.setFont("Helvetica", 12)
-        y = height - 170
-        c.drawString(50, y, f"ID: {scan.get('patient_id', 'Unknown')}")
-        c.drawString(50, y - 20, f"Name: {scan.get('patient_name', 'Unknown')}")
-        c.drawString(50, y - 40, f"Date: {scan['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
-
-        # --- Diagnosis Result ---
-        c.setFont("Helvetica-Bold", 14)
-        c.drawString(50, y - 80, "AI Diagnostic Analysis")
-        
-        c.setFont("Helvetica", 12)
-        diag_grade = scan['diagnosis']
-        confidence = f"{scan['confidence']*100:.1f}%"
-        
-        # Color coding text based on severity (Simulated by drawing simplified text)
-        c.drawString(50, y - 110, f"Condition: {diag_grade}")
-        c.drawString(50, y - 130, f"Confidence: {confidence}")
-        c.drawString(50, y - 150, f"Biological Age Est: {scan.get('biological_age', '--')} Years")
-        c.drawString(50, y - 170, f"Cardio Risk: {scan.get('cardiovascular_risk', '--')}")
-
-        # --- Image Evidence ---
-        # Extract filename from URL (http://localhost:8000/uploads/xyz.jpg -> uploads/xyz.jpg)
-        local_path = scan['file_url'].replace("http://localhost:8000/", "")
-        
-        # Determine where the image ends to start the explanation
-        y_image_bottom = y - 425 
-        
-        if os.path.exists(local_path):
-            img = ImageReader(local_path)
-            # Draw Image centered
-            img_width = 300
-            img_height = 225
-            c.drawImage(img, (width - img_width)/2, y - 425, width=img_width, height=img_height, preserveAspectRatio=True)
-            
-            c.setFont("Helvetica-Oblique", 9)
-            c.setFillColorRGB(0.3, 0.3, 0.3)
-            c.drawCentredString(width/2, y - 440, "Figure 1: Analyzed Retinal Fundus Scan")
-            y_explanation_start = y - 480
-        else:
-            y_explanation_start = y - 200 # If no image, start higher
-
-        # --- Glossary / Educational Section ---
-        c.setFillColorRGB(0.06, 0.3, 0.27) # Medical Green
-        
-        # Helper function to print a section
-        def print_section(title, items, start_y):
-            # Check for page break before section title
-            nonlocal c, height # Access outer canvas and height
-            current_y = start_y
-            
-            if current_y < 120:
-                c.showPage()
-                current_y = height - 50
-                c.setFillColorRGB(0.06, 0.3, 0.27)
-            
-            c.setFont("Helvetica-Bold", 12)
-            c.drawString(50, current_y, title)
-            c.setFillColorRGB(0, 0, 0)
-            
-            current_y -= 25
-            
-            for item_title, item_desc in items:
-                # Check for page break
-                if current_y < 100:
-                    c.showPage()
-                    current_y = height - 50
-                
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(50, current_y, item_title)
-                
-                c.setFont("Helvetica", 10)
-                # Wrap text
-                wrapped_lines = textwrap.wrap(item_desc, width=90)
-                
-                desc_y = current_y - 15
-                for line in wrapped_lines:
-                    c.drawString(50, desc_y, line)
-                    desc_y -= 12
-                
-                current_y = desc_y - 10
-            
-            return current_y - 10 # Extra space after section
-
-        # 1. Definitions
-        definitions = [
-            ("Diabetic Retinopathy (DR):", "The AI scans for \"red lesions\" like micro-bleeds or leaky vessels. It compares these patterns against a massive database to see if they match known signs of disease."),
-            ("Cardiovascular Risk:", "It measures the Arteriolar-Venular Ratio (AVR)—the thickness of your arteries compared to your veins. If arteries are too narrow, it signals high blood pressure risk."),
-            ("Biological Age:", "It calculates a \"Retinal Age Gap\". If your eye vessels look older than your actual age, it suggests your body is aging faster than the calendar says.")
-        ]
-        
-        curr_y = print_section("Understanding Your Results", definitions, y_explanation_start)
-
-        # 2. Clinical Implications
-        implications = [
-           ("If High DR Risk:", "Indicates potential microvascular damage. Probability of proliferative retinopathy is high. Strong recommendation for immediate ophthalmological grading."),
-           ("If Elevated Cardio Risk:", "Arteriolar narrowing is a robust biomarker for systemic hypertension. Clinical correlation with blood pressure monitoring is prescribed."),
-           ("If Large Age Gap:", "Retinal vascular age exceeding chronological age correlates with oxidative stress. Suggests need for comprehensive metabolic screening.")
-        ]
-        curr_y = print_section("Clinical Implications & Risk Assessment", implications, curr_y)
-
-        # 3. Dietary Recommendations
-        diet = [
-            ("Retinal Defense:", "Increase intake of leafy greens (Spinach, Kale) rich in Lutein and Zeaxanthin to support macular pigment density."),
-            ("Vascular Integrity:", "Omega-3 rich foods (Salmon, Walnuts) to reduce endothelial inflammation and support vessel flexibility."),
-            ("Antioxidant Support:", "Berries (Blueberries, Goji) and Citrus fruits for Vitamin C to strengthen micro-vessels.")
-        ]
-        curr_y = print_section("Recommended Lifestyle & Dietary Interventions", diet, curr_y)
-
-        # --- Footer ---
-        c.setLineWidth(0.5)
-        c.setStrokeColorRGB(0.8, 0.8, 0.8)
-        c.line(50, 60, width - 50, 60)
-        
-        c.setFont("Helvetica", 8)
-        c.setFillColorRGB(0.5, 0.5, 0.5)
-        # Disclaimer (Left)
-        c.drawString(50, 45, "Generated by RetiNet Pro AI System. Informational purpose only.")
-        c.drawString(50, 35, "This report does not constitute medical advice.")
-        
-        # Physician (Right)
-        c.drawRightString(width - 50, 45, "Reviewing Physician: Karthi's AI Doctor")
-        c.drawRightString(width - 50, 35, "Verified Digital Signature")
-
-        c.showPage()
-        c.save()
-
-        buffer.seek(0)
-        return Response(content=buffer.getvalue(), media_type="application/pdf", headers={"Content-Disposition": f"attachment; filename=report_{scan_id}.pdf"})
+        # Conditional GET: the ETag only depends on the scan fields and template version
+        etag = report_etag(scan)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        _, pdf = await get_report_pdf(scan)
+        headers["Content-Disposition"] = f"attachment; filename=report_{scan_id}.pdf"
+        return Response(content=pdf, media_type="application/pdf", headers=headers)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Report Error: {e}")
+        ERRORS.inc(stage="report")
+        logger.exception("Report failed for scan %s", scan_id)
         raise HTTPException(status_code=500, detail=str(e))
 
+MAX_EXPORT_SCANS = int(os.environ.get("RETINET_MAX_EXPORT_SCANS", 2000))
+
+async def stream_report_zip(cursor):
+    """Renders reports in parallel (bounded window, original order) and streams them out as a zip."""
+    window = max(1, 2 * REPORT_WORKERS)
+    stream = ZipStream()
+    in_flight = deque()
+    try:
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            async for scan in cursor:
+                # Bulk exports read through the cache but don't evict interactive entries
+                in_flight.append((scan, asyncio.ensure_future(get_report_pdf(scan, remember=False))))
+                if len(in_flight) < window:
+                    continue
+                done_scan, task = in_flight.popleft()
+                archive.writestr(report_filename(done_scan), (await task)[1])
+                yield stream.drain()
+
+            while in_flight:
+                done_scan, task = in_flight.popleft()
+                archive.writestr(report_filename(done_scan), (await task)[1])
+                yield stream.drain()
+        # Central directory is written when the archive closes
+        yield stream.drain()
+    finally:
+        for _, task in in_flight:
+            task.cancel()
+
+@app.get("/reports/export")
+async def export_reports(
+    patient_id: str = None,
+    start: datetime.datetime = None,
+    end: datetime.datetime = None,
+    format: str = Query("zip", pattern="^(zip|pdf)$")
+):
+    """
+    Exports every report for a patient and/or date range, either as a streamed zip of
+    individual PDFs or as one merged PDF.
+    """
+    if not patient_id and not (start or end):
+        raise HTTPException(status_code=400, detail="Provide a patient_id and/or a start/end date range")
+
+    query = {}
+    if patient_id:
+        query["patient_id"] = patient_id
+    if start or end:
+        query["timestamp"] = date_range(start, end)
+
+    total = await collection_scans.count_documents(query)
+    if total == 0:
+        raise HTTPException(status_code=404, detail="No scans match the export filters")
+    if total > MAX_EXPORT_SCANS:
+        raise HTTPException(status_code=413, detail=f"{total} scans match; narrow the range (limit {MAX_EXPORT_SCANS})")
+
+    label = patient_id or (f"{start:%Y%m%d}" if start else "export")
+    cursor = collection_scans.find(query, REPORT_PROJECTION).sort([("timestamp", 1), ("_id", 1)])
+
+    if format == "zip":
+        return StreamingResponse(
+            stream_report_zip(cursor),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename=reports_{label}.zip"},
+        )
+
+    # Merged PDF: one canvas in one worker process, written to disk and streamed from there
+    scans = await cursor.to_list(None)
+    path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.pdf")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(report_executor, render_merged_report, scans, path)
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=f"reports_{label}.pdf",
+        background=BackgroundTask(os.remove, path),
+    )
+
+# Pagination
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_SIMILAR = 100
+# Only the fields the History and Patients pages render
+HISTORY_FIELDS = {"timestamp": 1, "patient_id": 1, "patient_name": 1, "diagnosis": 1, "dr_grade": 1, "confidence": 1, "file_url": 1, "thumb_url": 1, "medium_url": 1, "model_version": 1}
+PATIENT_FIELDS = {"patient_id": 1, "name": 1, "mobile_number": 1, "last_scan": 1, "latest_diagnosis": 1, "scan_count": 1}
+
+def encode_cursor(sort_value, object_id):
+    raw = f"{sort_value.isoformat()}|{object_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        sort_value, object_id = raw.split("|")
+        return datetime.datetime.fromisoformat(sort_value), ObjectId(object_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_after(field, cursor):
+    """Matches documents strictly after the cursor in (field desc, _id desc) order."""
+    sort_value, object_id = decode_cursor(cursor)
+    return {"$or": [
+        {field: {"$lt": sort_value}},
+        {field: sort_value, "_id": {"$lt": object_id}},
+    ]}
+
+def date_range(start, end):
+    bounds = {}
+    if start:
+        bounds["$gte"] = start
+    if end:
+        bounds["$lt"] = end
+    return bounds
+
+async def fetch_page(collection, query, projection, sort_field, limit, response):
+    """Reads one page in (sort_field desc, _id desc) order and sets X-Next-Cursor when more remain."""
+    with time_stage("mongo_find"):
+        docs = await collection.find(query, projection).sort([(sort_field, -1), ("_id", -1)]).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(docs[-1][sort_field], docs[-1]["_id"])
+    return docs
+
 @app.get("/history")
-async def get_history(patient_id: str = None):
+async def get_history(
+    response: Response,
+    patient_id: str = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    start: datetime.datetime = None,
+    end: datetime.datetime = None,
+    grade: int = Query(None, ge=0, le=4)
+):
     query = {}
     if patient_id:
         query["patient_id"] = patient_id
-        
-    scans = await collection_scans.find(query).sort("timestamp", -1).to_list(100)
+    if grade is not None:
+        query["dr_grade"] = grade
+    if start or end:
+        query["timestamp"] = date_range(start, end)
+    if cursor:
+        query.update(keyset_after("timestamp", cursor))
+
+    scans = await fetch_page(collection_scans, query, HISTORY_FIELDS, "timestamp", limit, response)
     # Convert ObjectIDs to strings
     for scan in scans:
         scan["_id"] = str(scan["_id"])
     return scans
 
+@app.get("/similar/{scan_id}")
+async def similar_scans(scan_id: str, k: int = Query(10, ge=1, le=MAX_SIMILAR)):
+    """Most similar earlier scans graded by the same model, by cosine similarity of their embeddings."""
+    try:
+        object_id = ObjectId(scan_id)
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    with time_stage("mongo_find"):
+        scan = await collection_scans.find_one({"_id": object_id}, {"model_version": 1})
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+
+    index = get_embedding_index(scan.get("model_version") or "unknown")
+    with time_stage("similarity_search"):
+        matches = await asyncio.to_thread(index.search_scan, scan_id, k) if index else None
+    if matches is None:
+        raise HTTPException(status_code=404, detail="No embedding stored for this scan (graded by a backend without one, or before embeddings were kept)")
+
+    with time_stage("mongo_find"):
+        docs = await collection_scans.find({"_id": {"$in": [ObjectId(match_id) for match_id, _ in matches]}}, HISTORY_FIELDS).to_list(len(matches))
+    by_id = {str(doc["_id"]): doc for doc in docs}
+    results = []
+    for match_id, similarity in matches:
+        if match_id in by_id:  # Deleted scans stay in the index
+            results.append({**by_id[match_id], "_id": match_id, "similarity": round(similarity, 4)})
+    return results
+
 @app.get("/patients")
-async def get_patients():
-    pipeline = [
-       {"$group": {
-           "_id": "$mobile_number",
-           "name": {"$first": "$patient_name"},
-           "last_scan": {"$max": "$timestamp"},
-           "latest_diagnosis": {"$last": "$diagnosis"}, 
-           "scan_count": {"$sum": 1},
-           "patient_id": {"$first": "$patient_id"}
-       }}
-    ]
-    patients_agg = await collection_scans.aggregate(pipeline).to_list(100)
-    
+async def get_patients(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
+    start: datetime.datetime = None,
+    end: datetime.datetime = None
+):
+    # Indexed read of the maintained patient summaries, most recently scanned first
+    query = {}
+    if start or end:
+        query["last_scan"] = date_range(start, end)
+    if cursor:
+        query.update(keyset_after("last_scan", cursor))
+
+    patients = await fetch_page(collection_patients, query, PATIENT_FIELDS, "last_scan", limit, response)
+
     # Clean up for frontend
     results = []
-    for p in patients_agg:
-        if p["_id"] and p["_id"] != "Unknown": # Filter out unknown/test uploads if needed
-             results.append({
-                 "id": p["patient_id"],
-                 "name": p["name"],
-                 "mobile": p["_id"],
-                 "lastScan": p["last_scan"],
-                 "status": p["latest_diagnosis"],
-                 "scanCount": p["scan_count"]
-             })
+    for p in patients:
+        results.append({
+            "id": p["patient_id"],
+            "name": p.get("name"),
+            "mobile": p["mobile_number"],
+            "lastScan": p.get("last_scan"),
+            "status": p.get("latest_diagnosis"),
+            "scanCount": p.get("scan_count", 0)
+        })
     return results
 
+@app.get("/ready")
+async def readiness():
+    if not model_status["ready"]:
+        return JSONResponse(status_code=503, content=model_status)
+    return model_status
+
+@app.get("/inference/stats")
+async def get_inference_stats():
+    return {
+        **inference_engine.stats(),
+        "result_cache": result_cache.stats(),
+        "report_cache": {"size_bytes": report_cache.size, "entries": len(report_cache.entries), "hits": report_cache.hits, "misses": report_cache.misses},
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition: stage/request latency histograms, batch sizes, queue depth, cache lookups, errors."""
+    engine_stats = inference_engine.stats()
+    QUEUE_DEPTH.set(engine_stats["queue_depth"])
+    PENDING.set(engine_stats["pending"])
+    cache_stats = result_cache.stats()
+    CACHE_LOOKUPS.set(cache_stats["hits"], cache="result", outcome="hit")
+    CACHE_LOOKUPS.set(cache_stats["mongo_hits"], cache="result", outcome="mongo_hit")
+    CACHE_LOOKUPS.set(cache_stats["misses"], cache="result", outcome="miss")
+    CACHE_LOOKUPS.set(report_cache.hits, cache="report", outcome="hit")
+    CACHE_LOOKUPS.set(report_cache.misses, cache="report", outcome="miss")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/models")
+async def list_models():
+    """Registered model versions, the ACTIVE one and what this process is serving right now."""
+    registry = inference.registry
+    return {
+        "serving": inference.model_version,
+        "active": await asyncio.to_thread(registry.active_version),
+        "swap": model_status.get("swap"),
+        "versions": await asyncio.to_thread(registry.list),
+    }
+
+@app.post("/models/{version}/activate", status_code=202)
+async def activate_model(version: str):
+    """Starts a zero-downtime swap to a registered version; poll GET /models for progress."""
+    if await asyncio.to_thread(inference.registry.get, version) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model version '{version}'")
+    if model_swap_lock.locked():
+        raise HTTPException(status_code=409, detail="A model swap is already in progress")
+    run_in_background(swap_model(version))
+    return {"status": "swapping", "version": version}
+
 @app.get("/")
 def read_root():
     return {"message": "RetiNet Pro AI Engine Operational"}
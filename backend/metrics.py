@@ -0,0 +1,151 @@
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Config
+PROFILE_SAMPLE_RATE = float(os.environ.get("RETINET_PROFILE_SAMPLE_RATE", 0))  # Fraction of batches run under torch.profiler
+PROFILE_SLOW_MS = float(os.environ.get("RETINET_PROFILE_SLOW_MS", 500))  # Only traces slower than this are kept
+PROFILE_DIR = os.environ.get("RETINET_PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+logger = logging.getLogger("retinet")
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+class Metric:
+    """One metric family in the Prometheus text format; samples are keyed by their sorted label pairs."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        # Observed from the event loop, decode workers and the forward thread alike
+        self.lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # For mirroring totals that are already counted elsewhere (e.g. ResultCache.hits)
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+REGISTRY = []
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+# --- Metrics ---
+REQUEST_SECONDS = _register(Histogram("retinet_request_seconds", "End-to-end HTTP request latency by route."))
+STAGE_SECONDS = _register(Histogram("retinet_stage_seconds", "Time spent in each request-path stage (upload, decode, transform, queue_wait, forward, mongo_*, ...)."))
+BATCH_SIZE = _register(Histogram("retinet_batch_size", "Images per forward pass.", BATCH_SIZE_BUCKETS))
+ERRORS = _register(Counter("retinet_errors_total", "Failures by stage."))
+CACHE_LOOKUPS = _register(Counter("retinet_cache_lookups_total", "Result and report cache lookups by outcome."))
+QUEUE_DEPTH = _register(Gauge("retinet_queue_depth", "Scans waiting to be batched."))
+PENDING = _register(Gauge("retinet_pending_requests", "Scans admitted to the inference engine (decoding, queued or in a batch)."))
+REJECTED = _register(Counter("retinet_rejected_total", "Scans shed with 503 because the engine was saturated."))
+QUALITY_REJECTED = _register(Counter("retinet_quality_rejected_total", "Uploads rejected by the image-quality gate before inference (forward passes avoided), by reason."))
+PROFILES_SAVED = _register(Counter("retinet_profiles_saved_total", "Slow-batch torch profiler traces written to disk."))
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+@contextmanager
+def time_stage(stage):
+    """Observes the block's duration under retinet_stage_seconds; exceptions also count as a stage error."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+@contextmanager
+def profile_if_sampled(name):
+    """
+    Runs a sampled fraction of blocks under torch.profiler and keeps a Chrome trace
+    (open in chrome://tracing or Perfetto) only when the block was slow.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        yield
+        return
+
+    from torch.profiler import profile, ProfilerActivity
+
+    started = time.perf_counter()
+    with profile(activities=[ProfilerActivity.CPU], record_shapes=True) as prof:
+        yield
+    elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+    if elapsed_ms >= PROFILE_SLOW_MS:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}_{int(time.time() * 1000)}_{elapsed_ms:.0f}ms.json")
+        prof.export_chrome_trace(path)
+        PROFILES_SAVED.inc()
+        logger.warning("Slow %s (%.0f ms), profiler trace saved to %s", name, elapsed_ms, path)
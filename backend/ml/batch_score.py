@@ -0,0 +1,265 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+import torch
+from bson import ObjectId
+from pymongo import MongoClient, UpdateMany, UpdateOne
+from tqdm import tqdm
+
+# Run from backend/ like train.py; make the serving modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import inference
+from inference import DR_LABELS, configure_torch_threads, load_and_preprocess, predict_batch
+from similarity import EMBEDDINGS_ENABLED, get_index
+from storage import IMAGE_EXTENSIONS, UPLOAD_DIR
+
+# Config
+MONGO_URL = "mongodb://localhost:27017"
+CHECKPOINT_PATH = "ml/models/checkpoints/batch_score.json"
+URL_PREFIX = "http://localhost:8000/"
+UPLOAD_URL = f"{URL_PREFIX}uploads/"  # file_url of an original is UPLOAD_URL + its path under UPLOAD_DIR
+BATCH_SIZE = 64
+PAGE_SIZE = 4096  # Scans (or files) handed to one DataLoader pass
+NUM_GRADES = len(DR_LABELS)
+
+class ScoringDataset(torch.utils.data.Dataset):
+    """(key, path) pairs decoded with the serving preprocessing (load_and_preprocess, no quality gate)."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        key, path = self.items[index]
+        try:
+            return key, load_and_preprocess(path), None
+        except Exception as e:
+            return key, None, f"{type(e).__name__}: {e}"
+
+def collate(samples):
+    """Keeps unreadable files out of the forward pass instead of failing the whole batch."""
+    keys = [key for key, tensor, _ in samples if tensor is not None]
+    tensors = [tensor for _, tensor, _ in samples if tensor is not None]
+    failures = [(key, error) for key, tensor, error in samples if tensor is None]
+    return keys, tensors, failures
+
+def mongo_pages(scans, query, cursor, page_size):
+    """Scan records in _id order after `cursor`, a page at a time, as {_id: scan} dicts."""
+    projection = {"file_url": 1, "dr_grade": 1, "confidence": 1, "model_version": 1, "patient_id": 1, "timestamp": 1}
+    while True:
+        page_query = {**query, "_id": {"$gt": ObjectId(cursor)}} if cursor else query
+        page = list(scans.find(page_query, projection).sort("_id", 1).limit(page_size))
+        if not page:
+            return
+        cursor = str(page[-1]["_id"])
+        yield cursor, {str(scan["_id"]): scan for scan in page}
+
+def upload_files(directory):
+    """Originals under `directory` (flat or sharded) in a stable order, skipping WebP derivatives."""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/"))
+    return sorted(paths)
+
+def dir_pages(directory, cursor, page_size):
+    paths = [path for path in upload_files(directory) if cursor is None or path > cursor]
+    for start in range(0, len(paths), page_size):
+        page = paths[start:start + page_size]
+        yield page[-1], {path: None for path in page}
+
+def scan_path(scan):
+    # Same URL -> file mapping as the PDF reports
+    return scan.get("file_url", "").replace(URL_PREFIX, "")
+
+def grade_update(result, old, now):
+    """$set of the new grade, keeping the replaced one in previous_grades for audit."""
+    update = {"$set": {
+        "dr_grade": result["dr_grade"],
+        "diagnosis": DR_LABELS[result["dr_grade"]],
+        "confidence": result["confidence"],
+        "model_version": result["model_version"],
+        "regraded_at": now,
+    }}
+    if old is not None and "dr_grade" in old:
+        update["$push"] = {"previous_grades": {key: old.get(key) for key in ("dr_grade", "confidence", "model_version")}}
+    return update
+
+def load_checkpoint(path, source, version):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        state = json.load(f)
+    if state.get("source") != source or state.get("model_version") != version:
+        print(f"⚠️ Checkpoint {path} is for {state.get('source')} / {state.get('model_version')}, starting over")
+        return None
+    return state
+
+def save_checkpoint(path, state):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = f"{path}.part"
+    with open(temp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, path)
+
+def print_confusion(confusion):
+    """Old grades (rows) against new grades (columns)."""
+    total = sum(map(sum, confusion))
+    if not total:
+        return
+    width = max(len(label) for label in DR_LABELS.values()) + 2
+    print(f"\n📊 Old grade (rows) vs new grade (columns), {total} scans")
+    print(" " * width + "".join(f"{DR_LABELS[grade]:>{width}}" for grade in range(NUM_GRADES)))
+    for grade, row in enumerate(confusion):
+        print(f"{DR_LABELS[grade]:<{width}}" + "".join(f"{count:>{width}}" for count in row))
+    agreement = sum(confusion[grade][grade] for grade in range(NUM_GRADES)) / total
+    changed = total - sum(confusion[grade][grade] for grade in range(NUM_GRADES))
+    print(f"Agreement: {agreement:.2%} ({changed} grades changed)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-grade archived scans offline: DataLoader workers decode, the model scores in large batches, results go back to MongoDB in bulk.")
+    parser.add_argument("--source", choices=["mongo", "dir"], default="mongo", help="mongo: scan records (re-graded in place); dir: every image under --dir")
+    parser.add_argument("--dir", default=UPLOAD_DIR, help="Image directory for --source dir")
+    parser.add_argument("--query", default=None, help="Extra Mongo filter as JSON, e.g. '{\"patient_id\": \"P-1A2B3C4D5E\"}'")
+    parser.add_argument("--all", action="store_true", help="Also re-grade scans already graded by this model version")
+    parser.add_argument("--version", default=None, help="Registry version to score with (default: the registry's ACTIVE one, else the weights file)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader worker processes decoding images")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for the forward pass (default: all cores)")
+    parser.add_argument("--dry-run", action="store_true", help="Score and report, but write nothing to MongoDB or the checkpoint")
+    parser.add_argument("--output", default=None, help="Also write path/scan, old and new grade, confidence to this CSV")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--no-resume", action="store_true", help="Ignore the checkpoint and start from the beginning")
+    parser.add_argument("--mongo-url", default=MONGO_URL)
+    args = parser.parse_args()
+
+    configure_torch_threads(args.threads or os.cpu_count() or 1)
+    served = inference.load_registry_model(args.version) if args.version else inference.load_startup_model()
+    print(f"📦 Scoring with {served.version}")
+
+    client = MongoClient(args.mongo_url)
+    scans = client.retinet_db.scans
+    patients = client.retinet_db.patients
+    write = not args.dry_run
+
+    # A dry run neither resumes nor saves a checkpoint: a real run must not skip scans it only scored
+    state = None if args.no_resume or args.dry_run else load_checkpoint(args.checkpoint, args.source, served.version)
+    if state:
+        print(f"🔄 Resuming after {state['cursor']} ({state['processed']} already scored)")
+    else:
+        state = {"source": args.source, "model_version": served.version, "cursor": None, "processed": 0, "failed": 0,
+                 "elapsed_seconds": 0.0, "confusion": [[0] * NUM_GRADES for _ in range(NUM_GRADES)]}
+    confusion = state["confusion"]
+
+    if args.source == "mongo":
+        query = json.loads(args.query) if args.query else {}
+        if not args.all:
+            # Re-runs only pick up what this model hasn't graded yet
+            query["model_version"] = {"$ne": served.version}
+        pages = mongo_pages(scans, query, state["cursor"], PAGE_SIZE)
+        total = scans.count_documents(query) if not state["cursor"] else None
+    else:
+        pages = dir_pages(args.dir, state["cursor"], PAGE_SIZE)
+        total = None
+
+    output = None
+    if args.output:
+        new_file = not os.path.exists(args.output) or state["processed"] == 0
+        output = open(args.output, "w" if new_file else "a", newline="")
+        writer = csv.writer(output)
+        if new_file:
+            writer.writerow(["key", "old_grade", "new_grade", "confidence", "model_version"])
+
+    # Embeddings for the new model, so /similar works for re-graded scans once it is served
+    index = None
+    progress = tqdm(total=total, unit="img", desc="Scoring")
+    started = time.perf_counter() - state["elapsed_seconds"]
+    try:
+        for cursor, page in pages:
+            if args.source == "mongo":
+                items = [(key, scan_path(scan)) for key, scan in page.items()]
+            else:
+                items = [(key, os.path.join(args.dir, key)) for key in page]
+            loader = torch.utils.data.DataLoader(
+                ScoringDataset(items), batch_size=args.batch_size, num_workers=args.workers, collate_fn=collate,
+                pin_memory=inference.device.type == "cuda")
+
+            for keys, tensors, failures in loader:
+                for key, error in failures:
+                    tqdm.write(f"⚠️ Skipped {key}: {error}")
+                state["failed"] += len(failures)
+                if not tensors:
+                    progress.update(len(failures))
+                    continue
+
+                results = predict_batch(tensors, ("dr_grade",), served)
+                now = datetime.datetime.now()
+                requests, patient_requests, old_grades = [], [], {}
+
+                if args.source == "mongo":
+                    for key, result in zip(keys, results):
+                        old = page[key]
+                        old_grades[key] = [old.get("dr_grade")]
+                        requests.append(UpdateOne({"_id": ObjectId(key)}, grade_update(result, old, now)))
+                        if old.get("patient_id") and old.get("timestamp"):
+                            # The patient list shows the diagnosis of each patient's latest scan
+                            patient_requests.append(UpdateOne(
+                                {"patient_id": old["patient_id"], "last_scan": old["timestamp"]},
+                                {"$set": {"latest_diagnosis": DR_LABELS[result["dr_grade"]]}}))
+                else:
+                    urls = {f"{UPLOAD_URL}{key}": key for key in keys}
+                    # The same file can back several scans (uploads are stored by content hash)
+                    for scan in scans.find({"file_url": {"$in": list(urls)}}, {"file_url": 1, "dr_grade": 1}):
+                        old_grades.setdefault(urls[scan["file_url"]], []).append(scan.get("dr_grade"))
+                    for key, result in zip(keys, results):
+                        if key in old_grades:
+                            requests.append(UpdateMany({"file_url": f"{UPLOAD_URL}{key}"}, grade_update(result, None, now)))
+
+                for key, result in zip(keys, results):
+                    for old_grade in old_grades.get(key, []):
+                        if old_grade is not None:
+                            confusion[old_grade][result["dr_grade"]] += 1
+                    if output:
+                        old = old_grades.get(key) or [None]
+                        writer.writerow([key, old[0], result["dr_grade"], f"{result['confidence']:.4f}", result["model_version"]])
+
+                if write and requests:
+                    scans.bulk_write(requests, ordered=False)
+                    if patient_requests:
+                        patients.bulk_write(patient_requests, ordered=False)
+                    if args.source == "mongo" and EMBEDDINGS_ENABLED:
+                        for key, result in zip(keys, results):
+                            if "embedding" in result:
+                                index = index or get_index(served.version, len(result["embedding"]))
+                                image_hash = os.path.splitext(os.path.basename(page[key]["file_url"]))[0]
+                                index.add(key, image_hash, result["embedding"])
+
+                state["processed"] += len(keys)
+                progress.update(len(keys) + len(failures))
+
+            # Only move the cursor once a whole page is scored and written
+            state["cursor"] = cursor
+            state["elapsed_seconds"] = time.perf_counter() - started
+            if write:
+                save_checkpoint(args.checkpoint, state)
+    finally:
+        progress.close()
+        if output:
+            output.close()
+
+    elapsed = time.perf_counter() - started
+    rate = state["processed"] / elapsed if elapsed else 0.0
+    print(f"✅ Scored {state['processed']} images ({state['failed']} unreadable) in {elapsed:.1f}s: {rate:.1f} images/sec")
+    if args.dry_run:
+        print("   (dry run: MongoDB was not changed)")
+    print_confusion(confusion)
+
+if __name__ == "__main__":
+    main()
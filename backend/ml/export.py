@@ -0,0 +1,180 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+import torch
+from torchvision import datasets
+from tqdm import tqdm
+
+# Run from backend/ like train.py; make the serving modules importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from inference import transform_pipeline
+from model_backends import ARTIFACT_DIR, ARTIFACT_FILES, INPUT_SHAPE, build_fp32_model, load_backend, select_quantized_engine, write_artifact_source
+from model_registry import ModelRegistry
+
+# Config
+DATA_DIR = "../data/processed"
+WEIGHTS_PATH = "ml/models/retinet_v1.pth"
+REPORT_FILE = "export_report.json"  # Written next to the artifacts
+EXPORTABLE = ["int8_static", "torchscript", "onnx"]
+PARITY_BACKENDS = ["int8_dynamic", "int8_static", "torchscript", "onnx"]
+
+def get_val_loader(batch_size):
+    val_dir = os.path.join(DATA_DIR, "val")
+    if not os.path.exists(val_dir):
+        raise SystemExit("❌ Processed val split not found. Run 'prepare_dataset.py' first.")
+    # Same preprocessing as the /analyze endpoint, so calibration sees serving-time inputs
+    dataset = datasets.ImageFolder(val_dir, transform_pipeline)
+    return torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=4)
+
+def export_torchscript(fp32_model, path):
+    example = torch.randn(1, *INPUT_SHAPE)
+    with torch.no_grad():
+        traced = torch.jit.trace(fp32_model, example)
+    torch.jit.save(torch.jit.freeze(traced), path)
+
+def export_int8_static(fp32_model, loader, calib_batches, path):
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = select_quantized_engine()
+    example = (torch.randn(1, *INPUT_SHAPE),)
+    prepared = prepare_fx(copy.deepcopy(fp32_model).eval(), get_default_qconfig_mapping(engine), example)
+
+    # Calibrate activation ranges on the val split
+    with torch.no_grad():
+        for i, (inputs, _) in enumerate(tqdm(loader, desc="Calibrating", total=min(calib_batches, len(loader)))):
+            if i >= calib_batches:
+                break
+            prepared(inputs)
+
+    quantized = convert_fx(prepared)
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, example[0])
+    torch.jit.save(torch.jit.freeze(traced), path)
+    print(f"   (quantized engine: {engine})")
+
+def export_onnx(fp32_model, path, opset):
+    example = torch.randn(1, *INPUT_SHAPE)
+    torch.onnx.export(
+        fp32_model, example, path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+    )
+
+def run_predictions(runner, loader, max_batches=None):
+    """Returns (predicted classes, softmax probabilities, labels, seconds spent in forward)."""
+    preds, probs, labels = [], [], []
+    forward_seconds = 0.0
+    with torch.no_grad():
+        for i, (inputs, targets) in enumerate(loader):
+            if max_batches is not None and i >= max_batches:
+                break
+            started = time.perf_counter()
+            outputs = runner(inputs)
+            forward_seconds += time.perf_counter() - started
+            batch_probs = torch.nn.functional.softmax(outputs.float(), dim=1)
+            probs.append(batch_probs)
+            preds.append(batch_probs.argmax(dim=1))
+            labels.append(targets)
+    return torch.cat(preds), torch.cat(probs), torch.cat(labels), forward_seconds
+
+def parity_check(backends, loader, weights_path, artifact_dir, max_batches=None):
+    """Compares each exported backend against the fp32 eager model on the val split."""
+    print("\n🔬 Running accuracy-parity check against fp32...")
+    reference = build_fp32_model(weights_path, "cpu")
+    ref_preds, ref_probs, labels, ref_seconds = run_predictions(reference, loader, max_batches)
+    n = len(labels)
+
+    report = {"fp32": {
+        "accuracy": (ref_preds == labels).float().mean().item(),
+        "ms_per_image": ref_seconds / n * 1000.0,
+    }}
+
+    for name in backends:
+        artifact = os.path.join(artifact_dir, ARTIFACT_FILES[name]) if name in ARTIFACT_FILES else None
+        if artifact and not os.path.exists(artifact):
+            print(f"⚠️ Skipping {name}: {artifact} not found")
+            continue
+        runner = load_backend(name, weights_path, "cpu", artifact_dir=artifact_dir)
+        preds, probs, _, seconds = run_predictions(runner, loader, max_batches)
+        report[name] = {
+            "accuracy": (preds == labels).float().mean().item(),
+            "agreement_with_fp32": (preds == ref_preds).float().mean().item(),
+            "max_prob_diff": (probs - ref_probs).abs().max().item(),
+            "ms_per_image": seconds / n * 1000.0,
+            "speedup": ref_seconds / seconds if seconds else None,
+        }
+
+    print(f"\n{'backend':<14}{'acc':>8}{'agree':>8}{'maxΔp':>9}{'ms/img':>9}{'speedup':>9}")
+    for name, row in report.items():
+        agree = f"{row['agreement_with_fp32']:.4f}" if "agreement_with_fp32" in row else "-"
+        delta = f"{row['max_prob_diff']:.4f}" if "max_prob_diff" in row else "-"
+        speedup = f"{row['speedup']:.2f}x" if row.get("speedup") else "-"
+        print(f"{name:<14}{row['accuracy']:>8.4f}{agree:>8}{delta:>9}{row['ms_per_image']:>9.2f}{speedup:>9}")
+
+    report["num_images"] = n
+    report_path = os.path.join(artifact_dir, REPORT_FILE)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n📄 Parity report saved to {report_path}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export optimized CPU inference artifacts for RetiNet.")
+    parser.add_argument("--backends", nargs="+", default=EXPORTABLE, choices=EXPORTABLE, help="Artifacts to produce")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--calib-batches", type=int, default=20, help="Val batches used for int8 calibration")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--parity-only", action="store_true", help="Skip export, only compare existing artifacts")
+    parser.add_argument("--skip-parity", action="store_true")
+    parser.add_argument("--parity-batches", type=int, default=None, help="Limit val batches used for the parity check")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Exit non-zero if any backend agrees with fp32 less than this")
+    parser.add_argument("--version", default=None, help="Export a registered model version into its registry directory (default: ml/models/retinet_v1.pth)")
+    args = parser.parse_args()
+
+    weights_path, artifact_dir = WEIGHTS_PATH, ARTIFACT_DIR
+    if args.version:
+        registry = ModelRegistry()
+        meta = registry.get(args.version)
+        if meta is None:
+            raise SystemExit(f"❌ Unknown model version '{args.version}'")
+        if meta["arch"] != "resnet18":
+            raise SystemExit(f"❌ Only resnet18 versions can be exported ('{args.version}' is {meta['arch']})")
+        weights_path, artifact_dir = registry.weights_path(args.version), registry.version_dir(args.version)
+
+    if not os.path.exists(weights_path):
+        raise SystemExit(f"❌ {weights_path} not found. Run 'ml/train.py' first.")
+
+    loader = get_val_loader(args.batch_size)
+
+    if not args.parity_only:
+        fp32_model = build_fp32_model(weights_path, "cpu")
+        exporters = {
+            "torchscript": lambda path: export_torchscript(fp32_model, path),
+            "int8_static": lambda path: export_int8_static(fp32_model, loader, args.calib_batches, path),
+            "onnx": lambda path: export_onnx(fp32_model, path, args.opset),
+        }
+        for name in args.backends:
+            path = os.path.join(artifact_dir, ARTIFACT_FILES[name])
+            print(f"📦 Exporting {name} -> {path}")
+            exporters[name](path)
+            # Ties the artifact to these weights; load_backend ignores it once they change
+            write_artifact_source(path, weights_path)
+        print("✅ Export complete.")
+
+    if args.skip_parity:
+        return
+
+    report = parity_check(PARITY_BACKENDS, loader, weights_path, artifact_dir, args.parity_batches)
+    failing = [name for name, row in report.items()
+               if isinstance(row, dict) and row.get("agreement_with_fp32", 1.0) < args.min_agreement]
+    if failing:
+        print(f"❌ Prediction agreement below {args.min_agreement:.2%}: {', '.join(failing)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
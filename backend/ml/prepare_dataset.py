@@ -1,19 +1,65 @@
+import argparse
+import hashlib
+import io
+import json
 import os
-import shutil
-import pandas as pd
-from datasets import load_dataset
-import uuid
-from sklearn.model_selection import train_test_split
-from torchvision import transforms
+import time
+from datasets import load_dataset, Image as HFImage
 from PIL import Image
-from tqdm import tqdm
 
 # Config
 DATA_DIR = "data/raw"
 PROCESSED_DIR = "../data/processed"
+MANIFEST_PATH = os.path.join(PROCESSED_DIR, "manifest.json")
 IMG_SIZE = 224
+VAL_FRACTION = 0.2
 
-def prepare_data():
+def _image_bytes(image):
+    # With decode=False the column holds the encoded file, either inline or as a path on disk
+    if image.get("bytes") is not None:
+        return image["bytes"]
+    with open(image["path"], "rb") as f:
+        return f.read()
+
+def hash_example(example):
+    return {"sha256": hashlib.sha256(_image_bytes(example["image"])).hexdigest()}
+
+def assign_split(sha256):
+    # Derived from the content hash, so an example keeps its split when the dataset is updated
+    return "val" if int(sha256[:8], 16) % 100 < VAL_FRACTION * 100 else "train"
+
+def target_path(sha256, split, label):
+    return os.path.join(PROCESSED_DIR, split, str(label), f"{sha256[:16]}.png")
+
+def write_example(example):
+    sha256 = example["sha256"]
+    dst_path = target_path(sha256, assign_split(sha256), example["label"])
+    temp_path = f"{dst_path}.part"
+
+    image = Image.open(io.BytesIO(_image_bytes(example["image"])))
+    image = image.resize((IMG_SIZE, IMG_SIZE))
+    image.save(temp_path, format="PNG")
+    # Atomic rename: an interrupted run never leaves a truncated PNG at the final path
+    os.replace(temp_path, dst_path)
+    return {"written": True}
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    with open(MANIFEST_PATH) as f:
+        return json.load(f)
+
+def save_manifest(manifest):
+    temp_path = f"{MANIFEST_PATH}.part"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, MANIFEST_PATH)
+
+def report_stage(name, count, started):
+    elapsed = time.perf_counter() - started
+    print(f"⏱️ {name}: {count} examples in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)")
+
+def prepare_data(num_proc=None):
     """
     Organizes APTOS/RFMiD dataset into a standard structure for PyTorch.
     Expected Raw Structure:
@@ -22,15 +68,19 @@ def prepare_data():
         │   ├── 000c1434d8d7.png
         │   └── ...
         └── train.csv (Must contain 'id_code' and 'diagnosis')
+
+    Images are written as <sha256 prefix>.png. manifest.json records every processed
+    example, so reruns only resize/encode examples that are new or whose bytes changed;
+    any other file under train/ and val/ is removed.
     """
-    print("🚀 Starting Data Preprocessing...")
-    
     print("🚀 Starting Data Preprocessing (Powered by Hugging Face)...")
-    
+    num_proc = num_proc or os.cpu_count()
+
     # 1. Download from Hugging Face
     dataset_name = "karthiban55/RetiNetPro-Dataset"
     print(f"📥 Downloading dataset: {dataset_name}...")
-    
+
+    started = time.perf_counter()
     try:
         # Load dataset (this automatically handles caching)
         dataset = load_dataset(dataset_name)
@@ -39,58 +89,66 @@ def prepare_data():
         print(f"❌ Error downloading dataset: {e}")
         return
 
+    # Keep images encoded until an example actually has to be written
+    full_dataset = dataset['train'].cast_column("image", HFImage(decode=False))
+    report_stage("Load", len(full_dataset), started)
+
     # 2. Create processed directories
     for split in ['train', 'val']:
         for i in range(5): # 5 Classes (0-4) for DR
             os.makedirs(os.path.join(PROCESSED_DIR, split, str(i)), exist_ok=True)
 
-    # 3. Process and Save
-    # The dataset from ImageFolder/HF usually has 'image' (PIL) and 'label' columns
-    # We need to respect the split if it exists, or create one.
-    
-    # Using 'train' split from HF for everything, then splitting manually if needed
-    # Or if HF repo has train/test splits, use those. 
-    # For a simple image folder upload, it usually loads as 'train'.
-    
-    full_dataset = dataset['train']
-    
-    # Convert HF dataset to Pandas for easy splitting (or use HF split)
-    # But to keep logic similar to before, let's extract metadata
-    
-    # However, HF datasets are best used directly. 
-    # But since train.py expects a specific folder structure, we will "hydrate" that structure
-    # from the HF dataset. This allows train.py to remain largely unchanged for now.
-    
-    print("🔄 Organizing data into local folders...")
-    
-    # Helper to save image
-    def save_hf_image(example, split_name):
-        image = example['image']
-        label = example['label']
-        if 'id_code' in example:
-             filename = f"{example['id_code']}.png"
-        else:
-             # Fallback if no ID
-             filename = f"{uuid.uuid4()}.png"
-             
-        dst_path = os.path.join(PROCESSED_DIR, split_name, str(label), filename)
-        
-        if not os.path.exists(dst_path): # Avoid re-writing if exists
-             image = image.resize((IMG_SIZE, IMG_SIZE))
-             image.save(dst_path)
-             
-    # Split 80/20
-    header_dataset = full_dataset.train_test_split(test_size=0.2, seed=42, stratify_by_column="label")
-    train_ds = header_dataset['train']
-    val_ds = header_dataset['test']
-    
-    for example in tqdm(train_ds, desc="Processing Train"):
-         save_hf_image(example, 'train')
-         
-    for example in tqdm(val_ds, desc="Processing Val"):
-         save_hf_image(example, 'val')
-
-    print("🎉 Data preparation complete! Ready for training.")
+    # 3. Hash every example's encoded bytes (cached by datasets between runs)
+    started = time.perf_counter()
+    hashed = full_dataset.map(hash_example, num_proc=num_proc, desc="Hashing")
+    report_stage("Hash", len(hashed), started)
+
+    # 4. Plan against the manifest: new/changed examples are written, vanished ones removed
+    started = time.perf_counter()
+    manifest = load_manifest()
+    wanted = {}
+    todo = []
+    for idx, (sha256, label) in enumerate(zip(hashed["sha256"], hashed["label"])):
+        entry = {"split": assign_split(sha256), "label": int(label)}
+        entry["file"] = os.path.relpath(target_path(sha256, entry["split"], entry["label"]), PROCESSED_DIR)
+        if sha256 in wanted:
+            continue  # Duplicate image, first label wins
+        wanted[sha256] = entry
+        if manifest.get(sha256) != entry or not os.path.exists(os.path.join(PROCESSED_DIR, entry["file"])):
+            todo.append(idx)
+
+    stale = [entry["file"] for sha256, entry in manifest.items() if wanted.get(sha256) != entry]
+    # Also anything the manifest doesn't know about, e.g. id_code-named PNGs from a tree written
+    # before it existed, which would otherwise duplicate images across (and within) the splits
+    expected = {entry["file"] for entry in wanted.values()}
+    for split in ['train', 'val']:
+        for root, _, files in os.walk(os.path.join(PROCESSED_DIR, split)):
+            for name in files:
+                rel_path = os.path.relpath(os.path.join(root, name), PROCESSED_DIR)
+                if rel_path not in expected and rel_path not in stale:
+                    stale.append(rel_path)
+    for rel_path in stale:
+        path = os.path.join(PROCESSED_DIR, rel_path)
+        if os.path.exists(path):
+            os.remove(path)
+    report_stage("Plan", len(hashed), started)
+    print(f"🗂️ {len(wanted) - len(todo)} up to date, {len(todo)} to write, {len(stale)} stale removed")
+
+    # 5. Resize and save only what changed, across worker processes
+    if todo:
+        started = time.perf_counter()
+        hashed.select(todo).map(
+            write_example, num_proc=min(num_proc, len(todo)),
+            load_from_cache_file=False, desc="Writing",
+        )
+        report_stage("Write", len(todo), started)
+
+    save_manifest(wanted)
+    counts = {split: sum(1 for entry in wanted.values() if entry["split"] == split) for split in ['train', 'val']}
+    print(f"🎉 Data preparation complete! Ready for training. (train: {counts['train']}, val: {counts['val']})")
 
 if __name__ == "__main__":
-    prepare_data()
+    parser = argparse.ArgumentParser(description="Download and organize the RetiNet dataset into train/val ImageFolders.")
+    parser.add_argument("--num-proc", type=int, default=None, help="Worker processes (default: all cores)")
+    args = parser.parse_args()
+    prepare_data(args.num_proc)
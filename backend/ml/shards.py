@@ -0,0 +1,138 @@
+import argparse
+import bisect
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import datasets
+from tqdm import tqdm
+
+# Config
+DATA_DIR = "../data/processed"
+SHARD_DIR = "../data/shards"
+SHARD_INDEX = "index.json"
+IMG_SIZE = 224
+SHARD_SIZE = 4096  # Images per shard (~600 MB at 224x224x3)
+
+def _decode(path, image_size):
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+        if image.size != (image_size, image_size):
+            image = image.resize((image_size, image_size))
+        return np.asarray(image, dtype=np.uint8)
+
+def pack_split(split_dir, out_dir, image_size=IMG_SIZE, shard_size=SHARD_SIZE, workers=8):
+    """
+    Decodes an ImageFolder split once and packs it into .npy shards of uint8 HWC images,
+    plus one int64 label array per shard and an index.json describing them.
+    """
+    folder = datasets.ImageFolder(split_dir)
+    samples = folder.samples
+    os.makedirs(out_dir, exist_ok=True)
+
+    shards = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for shard_id, offset in enumerate(range(0, len(samples), shard_size)):
+            chunk = samples[offset:offset + shard_size]
+            images_file = f"images_{shard_id:04d}.npy"
+            labels_file = f"labels_{shard_id:04d}.npy"
+
+            images = np.lib.format.open_memmap(
+                os.path.join(out_dir, images_file), mode="w+", dtype=np.uint8,
+                shape=(len(chunk), image_size, image_size, 3),
+            )
+            decoded = pool.map(lambda sample: _decode(sample[0], image_size), chunk)
+            for i, array in enumerate(tqdm(decoded, total=len(chunk), desc=f"{os.path.basename(split_dir)} shard {shard_id}")):
+                images[i] = array
+            images.flush()
+            del images
+
+            np.save(os.path.join(out_dir, labels_file), np.array([label for _, label in chunk], dtype=np.int64))
+            shards.append({
+                "images": images_file,
+                "labels": labels_file,
+                "count": len(chunk),
+                # Source file names, to join per-image targets (e.g. train.py --targets-csv)
+                "files": [os.path.basename(path) for path, _ in chunk],
+            })
+
+    index = {
+        "classes": folder.classes,
+        "image_size": image_size,
+        "num_images": len(samples),
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, SHARD_INDEX), "w") as f:
+        json.dump(index, f, indent=2)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Packed {len(samples)} images into {len(shards)} shard(s) in {elapsed:.1f}s ({len(samples) / max(elapsed, 1e-9):.0f} img/s)")
+    return index
+
+def has_shards(split_dir):
+    return os.path.exists(os.path.join(split_dir, SHARD_INDEX))
+
+class ShardDataset(torch.utils.data.Dataset):
+    """
+    Reads packed shards through memory maps: __getitem__ returns a uint8 CHW tensor view of the
+    page-cache-backed array (no decode, no copy) and applies `transform` to it, so augmentation
+    still happens on the fly. Shards are opened lazily in each DataLoader worker.
+    """
+
+    def __init__(self, split_dir, transform=None):
+        self.split_dir = split_dir
+        self.transform = transform
+        with open(os.path.join(split_dir, SHARD_INDEX)) as f:
+            self.index = json.load(f)
+        self.classes = self.index["classes"]
+        self.offsets = np.cumsum([0] + [shard["count"] for shard in self.index["shards"]]).tolist()
+        self.targets = np.concatenate([
+            np.load(os.path.join(split_dir, shard["labels"])) for shard in self.index["shards"]
+        ]).tolist() if self.index["shards"] else []
+        self.files = [name for shard in self.index["shards"] for name in shard.get("files", [])]
+        self._images = None
+
+    def _open(self):
+        # Copy-on-write maps are writable for torch.from_numpy but never touch the files
+        self._images = [np.load(os.path.join(self.split_dir, shard["images"]), mmap_mode="c") for shard in self.index["shards"]]
+
+    def __getstate__(self):
+        # Ship paths, not mapped arrays, to spawned workers
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            self._open()
+        shard_id = bisect.bisect_right(self.offsets, idx) - 1
+        image = torch.from_numpy(self._images[shard_id][idx - self.offsets[shard_id]]).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[idx]
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the processed ImageFolder dataset into memory-mappable shards.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out-dir", default=SHARD_DIR)
+    parser.add_argument("--image-size", type=int, default=IMG_SIZE)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--workers", type=int, default=8, help="Decode threads")
+    args = parser.parse_args()
+
+    for split in ["train", "val"]:
+        split_dir = os.path.join(args.data_dir, split)
+        if not os.path.exists(split_dir):
+            raise SystemExit(f"❌ {split_dir} not found. Run 'prepare_dataset.py' first.")
+        print(f"📦 Packing {split_dir} -> {os.path.join(args.out_dir, split)}")
+        pack_split(split_dir, os.path.join(args.out_dir, split), args.image_size, args.shard_size, args.workers)
+
+if __name__ == "__main__":
+    main()
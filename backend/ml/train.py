@@ -1,27 +1,187 @@
+import argparse
+import csv
+import glob
+import math
+import random
+import time
+from contextlib import nullcontext
+import numpy as np
 import torch
+import torch.distributed as dist
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
 from torchvision import datasets, transforms
 import timm
-import copy
 import os
+import sys
 from tqdm import tqdm
+from shards import SHARD_DIR, ShardDataset, has_shards
+from vision_transformer import RetiNetModel
+
+# Run from backend/; make the serving modules importable (model registry)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import ModelRegistry
 
 # Config
 DATA_DIR = "../data/processed"
 MODEL_SAVE_PATH = "ml/models/retinet_v1.pth"
+MT_MODEL_SAVE_PATH = "ml/models/retinet_mt.pth"
+CHECKPOINT_DIR = "ml/models/checkpoints"
+NUM_DISEASES = 45
+# Relative weight of each head's loss in multi-task training (age is in years, hence smaller)
+TASK_LOSS_WEIGHTS = {"dr_grade": 1.0, "diseases": 1.0, "biological_age": 0.1, "cardio_risk": 1.0}
 BATCH_SIZE = 32
 EPOCHS = 10
 LR = 0.001
 
-def train_model():
-    print("🚀 Initializing RetiNet Training Sequence...")
-    
-    # 1. Device Config
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"✅ Using Device: {device}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the RetiNet DR grader.")
+    parser.add_argument("--task", choices=["dr", "multitask"], default="dr", help="dr: resnet18 grader; multitask: RetiNetModel with all four heads")
+    parser.add_argument("--backbone", default="vit_base_patch16_224", help="timm backbone for --task multitask (serve with the same RETINET_MT_BACKBONE)")
+    parser.add_argument("--targets-csv", default=None, help="Multi-task targets: filename, biological_age, cardio_risk, diseases (';'-separated class ids)")
+    parser.add_argument("--output", default=None, help="Where to save the best weights (default depends on --task)")
+    parser.add_argument("--register", action="store_true", help="Add the best weights to the model registry when training ends")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Per-step batch size")
+    parser.add_argument("--accum-steps", type=int, default=1, help="Steps per optimizer update (effective batch = batch-size x accum-steps)")
+    parser.add_argument("--lr", type=float, default=LR)
+    parser.add_argument("--precision", choices=["fp32", "bf16"], default="fp32", help="bf16 runs forward/loss under autocast")
+    parser.add_argument("--channels-last", action="store_true", help="Use NHWC memory format for model and inputs")
+    parser.add_argument("--compile", action="store_true", help="Wrap the model in torch.compile")
+    parser.add_argument("--workers", type=int, default=4, help="DataLoader worker processes")
+    parser.add_argument("--scheduler", choices=["plateau", "cosine", "none"], default="plateau", help="LR schedule (plateau watches val accuracy)")
+    parser.add_argument("--patience", type=int, default=3, help="Stop after this many epochs without val improvement (0 disables)")
+    parser.add_argument("--min-delta", type=float, default=0.0, help="Smallest val accuracy gain that counts as improvement")
+    parser.add_argument("--checkpoint-dir", default=None, help=f"Default: {CHECKPOINT_DIR} (dr) or {CHECKPOINT_DIR}/multitask")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Write a full checkpoint every N epochs")
+    parser.add_argument("--keep-checkpoints", type=int, default=2)
+    parser.add_argument("--no-resume", action="store_true", help="Ignore existing checkpoints and start from epoch 1")
+    parser.add_argument("--dist-backend", default="gloo", help="Process group backend when launched with torchrun")
+    parser.add_argument("--threads", type=int, default=None, help="Torch intra-op threads per process (default: cores / local processes under torchrun)")
+    args = parser.parse_args()
+    args.output = args.output or (MT_MODEL_SAVE_PATH if args.task == "multitask" else MODEL_SAVE_PATH)
+    args.checkpoint_dir = args.checkpoint_dir or (os.path.join(CHECKPOINT_DIR, "multitask") if args.task == "multitask" else CHECKPOINT_DIR)
+    return args
+
+def setup_distributed(args):
+    """Joins the torchrun process group when WORLD_SIZE > 1. Returns (rank, world size)."""
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size > 1:
+        dist.init_process_group(backend=args.dist_backend)
+        # torchrun defaults OMP_NUM_THREADS to 1; split the node's cores between its processes instead
+        local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+        torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_world_size))
+        return dist.get_rank(), world_size
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    return 0, 1
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def log(message):
+    if is_main_process():
+        print(message)
+
+def build_scheduler(args, optimizer):
+    if args.scheduler == "plateau":
+        return optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode="max", factor=0.1, patience=1)
+    if args.scheduler == "cosine":
+        return optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+    return None
+
+def capture_rng_state():
+    state = {"torch": torch.get_rng_state(), "python": random.getstate(), "numpy": np.random.get_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def restore_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def latest_checkpoint(checkpoint_dir):
+    paths = sorted(glob.glob(os.path.join(checkpoint_dir, "epoch_*.pt")))
+    return paths[-1] if paths else None
+
+def save_checkpoint(args, state):
+    """Writes epoch_NNN.pt atomically (safe against preemption mid-write) and prunes old ones."""
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    path = os.path.join(args.checkpoint_dir, f"epoch_{state['epoch']:03d}.pt")
+    torch.save(state, f"{path}.part")
+    os.replace(f"{path}.part", path)
+
+    for old in sorted(glob.glob(os.path.join(args.checkpoint_dir, "epoch_*.pt")))[:-args.keep_checkpoints]:
+        os.remove(old)
+    print(f"🗂️ Checkpoint written: {path}")
+
+def load_targets(path):
+    """Reads the multi-task targets CSV into {filename: row}. Blank cells stay unknown."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return {os.path.basename(row["filename"]): row for row in csv.DictReader(f) if row.get("filename")}
+
+def _float_or_nan(value):
+    return float(value) if value not in (None, "") else math.nan
+
+class MultiTaskDataset(torch.utils.data.Dataset):
+    """
+    Wraps an (image, dr_label) dataset and adds the other heads' targets by file name.
+    Unknown targets are NaN and masked out of their loss, so partially labelled data still trains.
+    """
+
+    def __init__(self, base, filenames, targets):
+        self.base = base
+        self.filenames = filenames
+        self.targets = targets
 
-    # 2. Data Transforms (Augmentation)
+    def __len__(self):
+        return len(self.base)
+
+    def __getitem__(self, idx):
+        image, label = self.base[idx]
+        row = self.targets.get(self.filenames[idx], {})
+
+        diseases = torch.full((NUM_DISEASES,), math.nan)
+        if row.get("diseases") is not None:
+            diseases.zero_()
+            for class_id in filter(None, row["diseases"].split(";")):
+                diseases[int(class_id)] = 1.0
+
+        return image, {
+            "dr_grade": label,
+            "diseases": diseases,
+            "biological_age": torch.tensor(_float_or_nan(row.get("biological_age"))),
+            "cardio_risk": torch.tensor(_float_or_nan(row.get("cardio_risk"))),
+        }
+
+def masked_mean(values, mask):
+    return (values * mask).sum() / mask.sum().clamp(min=1)
+
+def multitask_loss(outputs, targets):
+    """Weighted sum of the per-head losses, each averaged over the samples that have that target."""
+    outputs = {name: value.float() for name, value in outputs.items()}
+    loss = TASK_LOSS_WEIGHTS["dr_grade"] * F.cross_entropy(outputs["dr_grade"], targets["dr_grade"])
+
+    age = targets["biological_age"]
+    age_loss = F.smooth_l1_loss(outputs["biological_age"].squeeze(1), age.nan_to_num(), reduction="none")
+    loss = loss + TASK_LOSS_WEIGHTS["biological_age"] * masked_mean(age_loss, ~age.isnan())
+
+    risk = targets["cardio_risk"]
+    risk_loss = F.binary_cross_entropy_with_logits(outputs["cardio_risk"].squeeze(1), risk.nan_to_num(), reduction="none")
+    loss = loss + TASK_LOSS_WEIGHTS["cardio_risk"] * masked_mean(risk_loss, ~risk.isnan())
+
+    diseases = targets["diseases"]
+    disease_loss = F.binary_cross_entropy_with_logits(outputs["diseases"], diseases.nan_to_num(), reduction="none")
+    return loss + TASK_LOSS_WEIGHTS["diseases"] * masked_mean(disease_loss, ~diseases.isnan())
+
+def build_dataloaders(args, device):
+    # Data Transforms (Augmentation)
     data_transforms = {
         'train': transforms.Compose([
             transforms.RandomResizedCrop(224),
@@ -36,72 +196,246 @@ def train_model():
             transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
         ]),
     }
+    # Same augmentation applied to uint8 CHW tensors read from packed shards (no PIL decode)
+    shard_transforms = {
+        'train': transforms.Compose([
+            transforms.RandomResizedCrop(224, antialias=True),
+            transforms.RandomHorizontalFlip(),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+        'val': transforms.Compose([
+            transforms.Resize(256, antialias=True),
+            transforms.CenterCrop(224),
+            transforms.ConvertImageDtype(torch.float),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        ]),
+    }
 
-    # 3. Load Data
-    if not os.path.exists(DATA_DIR):
-        print("❌ Processed data not found. Run 'prepare_dataset.py' first.")
-        return
+    # Packed shards from 'ml/shards.py' when present, else the PNG tree
+    if all(has_shards(os.path.join(SHARD_DIR, x)) for x in ['train', 'val']):
+        print(f"📦 Using packed shards from {SHARD_DIR}")
+        image_datasets = {x: ShardDataset(os.path.join(SHARD_DIR, x), shard_transforms[x]) for x in ['train', 'val']}
+    elif os.path.exists(DATA_DIR):
+        image_datasets = {x: datasets.ImageFolder(os.path.join(DATA_DIR, x), data_transforms[x]) for x in ['train', 'val']}
+    else:
+        return None, None
 
-    image_datasets = {x: datasets.ImageFolder(os.path.join(DATA_DIR, x), data_transforms[x]) for x in ['train', 'val']}
-    dataloaders = {x: torch.utils.data.DataLoader(image_datasets[x], batch_size=BATCH_SIZE, shuffle=True, num_workers=4) for x in ['train', 'val']}
-    dataset_sizes = {x: len(image_datasets[x]) for x in ['train', 'val']}
+    if args.task == "multitask":
+        targets = load_targets(args.targets_csv) if args.targets_csv else {}
+        for x in ['train', 'val']:
+            base = image_datasets[x]
+            if isinstance(base, ShardDataset):
+                # Shards packed before the file names were recorded can't be matched to targets
+                if len(base.files) != len(base):
+                    raise SystemExit(f"❌ Shards in {os.path.join(SHARD_DIR, x)} don't list their files. Re-run 'ml/shards.py'.")
+                filenames = base.files
+            else:
+                filenames = [os.path.basename(path) for path, _ in base.samples]
+            image_datasets[x] = MultiTaskDataset(base, filenames, targets)
 
-    # 4. Initialize Model (ResNet18 for Speed, can switch to ViT)
-    model = timm.create_model('resnet18', pretrained=True, num_classes=5) # 5 Classes for DR
-    model = model.to(device)
+    train_sampler = None
+    if dist.is_initialized():
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        train_sampler = DistributedSampler(image_datasets['train'], shuffle=True)
+        # Strided val split without the padding DistributedSampler adds, so every image counts exactly once
+        image_datasets['val'] = torch.utils.data.Subset(image_datasets['val'], range(rank, len(image_datasets['val']), world_size))
 
-    # 5. Loss & Optimizer
-    criterion = nn.CrossEntropyLoss()
-    optimizer = optim.Adam(model.parameters(), lr=LR)
-    
-    # 6. Training Loop
-    best_acc = 0.0
+    dataloaders = {
+        x: torch.utils.data.DataLoader(
+            image_datasets[x],
+            batch_size=args.batch_size,
+            shuffle=(x == 'train' and train_sampler is None),
+            sampler=train_sampler if x == 'train' else None,
+            num_workers=args.workers,
+            # Pinned host memory only pays off when copying to a GPU
+            pin_memory=(device.type == "cuda"),
+            persistent_workers=args.workers > 0,
+        )
+        for x in ['train', 'val']
+    }
+    return dataloaders, train_sampler
 
-    for epoch in range(EPOCHS):
-        print(f"\nEpoch {epoch+1}/{EPOCHS}")
-        print("-" * 10)
+def run_epoch(model, loader, criterion, optimizer, device, args, phase, ddp=None):
+    """One pass over `loader`. Returns (loss, accuracy, samples/sec), aggregated over all ranks."""
+    training = phase == 'train'
+    model.train(training)
+    memory_format = torch.channels_last if args.channels_last else torch.contiguous_format
 
-        for phase in ['train', 'val']:
-            if phase == 'train':
-                model.train()
-            else:
-                model.eval()
+    # Accumulate on device; reading them back every step would force a sync per batch
+    running_loss = torch.zeros((), device=device)
+    running_corrects = torch.zeros((), dtype=torch.long, device=device)
+    seen = 0
+
+    started = time.perf_counter()
+    num_steps = len(loader)
+    for step, (inputs, targets) in enumerate(tqdm(loader, desc=f"{phase} loop", disable=not is_main_process())):
+        inputs = inputs.to(device, non_blocking=True, memory_format=memory_format)
+        # Multi-task batches carry a dict of targets, one tensor per head
+        if isinstance(targets, dict):
+            targets = {name: value.to(device, non_blocking=True) for name, value in targets.items()}
+            labels = targets["dr_grade"]
+        else:
+            targets = labels = targets.to(device, non_blocking=True)
+
+        update_step = (step + 1) % args.accum_steps == 0 or step + 1 == num_steps
+        # Only all-reduce gradients on the micro-step that updates the weights
+        sync_context = ddp.no_sync() if ddp is not None and training and not update_step else nullcontext()
+
+        with sync_context, torch.set_grad_enabled(training):
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=args.precision == "bf16"):
+                outputs = model(inputs)
+                loss = criterion(outputs, targets)
+            if training:
+                # Scale so accumulated gradients average over the effective batch
+                (loss / args.accum_steps).backward()
 
-            running_loss = 0.0
-            running_corrects = 0
+        if training and update_step:
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
 
-            # Iterate over data
-            for inputs, labels in tqdm(dataloaders[phase], desc=f"{phase} loop"):
-                inputs = inputs.to(device)
-                labels = labels.to(device)
+        running_loss += loss.detach() * inputs.size(0)
+        dr_logits = outputs["dr_grade"] if isinstance(outputs, dict) else outputs
+        running_corrects += (dr_logits.argmax(dim=1) == labels).sum()
+        seen += inputs.size(0)
 
-                optimizer.zero_grad()
+    totals = torch.stack([running_loss.double(), running_corrects.double(), torch.tensor(float(seen), dtype=torch.float64, device=device)])
+    elapsed = torch.tensor(time.perf_counter() - started, dtype=torch.float64, device=device)
+    if dist.is_initialized():
+        dist.all_reduce(totals)
+        # Throughput is bounded by the slowest rank
+        dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    loss_sum, corrects, seen = totals.tolist()
+    return loss_sum / seen, corrects / seen, seen / elapsed.item()
 
-                with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model(inputs)
-                    _, preds = torch.max(outputs, 1)
-                    loss = criterion(outputs, labels)
+def train_model(args):
+    rank, world_size = setup_distributed(args)
+    log("🚀 Initializing RetiNet Training Sequence...")
+
+    # 1. Device Config (gloo ranks train on CPU)
+    if args.dist_backend == "nccl" and world_size > 1:
+        device = torch.device(f"cuda:{int(os.environ.get('LOCAL_RANK', 0))}")
+    elif world_size > 1:
+        device = torch.device("cpu")
+    else:
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    log(f"✅ Using Device: {device} (world size {world_size}, {torch.get_num_threads()} threads per process)")
+
+    # 2. Load Data
+    dataloaders, train_sampler = build_dataloaders(args, device)
+    if dataloaders is None:
+        log("❌ Processed data not found. Run 'prepare_dataset.py' first.")
+        return
+
+    # 3. Initialize Model (ResNet18 for Speed, or the shared-backbone multi-task model)
+    if args.task == "multitask":
+        model = RetiNetModel(args.backbone, num_classes_disease=NUM_DISEASES)
+    else:
+        model = timm.create_model('resnet18', pretrained=True, num_classes=5) # 5 Classes for DR
+    model = model.to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    # Keep `model` for saving; the DDP/compiled wrappers prefix state_dict keys
+    ddp = None
+    runner = model
+
+    # 4. Loss & Optimizer
+    criterion = multitask_loss if args.task == "multitask" else nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), lr=args.lr)
+    scheduler = build_scheduler(args, optimizer)
+
+    # 5. Resume from the latest full checkpoint, if any
+    start_epoch = 0
+    best_acc = 0.0
+    stale_epochs = 0
+    checkpoint_path = None if args.no_resume else latest_checkpoint(args.checkpoint_dir)
+    if checkpoint_path:
+        # RNG and numpy state are not plain tensors, so this needs the full unpickler. Loaded on the
+        # CPU: set_rng_state wants CPU ByteTensors, and load_state_dict copies weights and optimizer
+        # state onto the parameters' device
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        if scheduler is not None and checkpoint.get("scheduler"):
+            scheduler.load_state_dict(checkpoint["scheduler"])
+        restore_rng_state(checkpoint["rng"])
+        start_epoch = checkpoint["epoch"]
+        best_acc = checkpoint["best_acc"]
+        stale_epochs = checkpoint["stale_epochs"]
+        log(f"🔄 Resumed from {checkpoint_path} (epoch {start_epoch}, best val acc {best_acc:.4f})")
+
+    # Wrap after resuming: DDP broadcasts rank 0's weights to every rank on construction
+    if world_size > 1:
+        ddp = DistributedDataParallel(model)
+        runner = ddp
+    if args.compile:
+        runner = torch.compile(runner)
+
+    log(f"⚙️ precision={args.precision} channels_last={args.channels_last} compile={args.compile} "
+        f"effective batch={args.batch_size * args.accum_steps * world_size} ({args.batch_size} x {args.accum_steps} x {world_size} ranks)")
+
+    # 6. Training Loop (nothing left to do when the resumed run had already stopped early)
+    end_epoch = args.epochs
+    if args.patience > 0 and stale_epochs >= args.patience:
+        log(f"⏹️ Early stopping: no val improvement for {stale_epochs} epochs (stopped before this resume)")
+        end_epoch = start_epoch
+    for epoch in range(start_epoch, end_epoch):
+        log(f"\nEpoch {epoch+1}/{args.epochs} (lr {optimizer.param_groups[0]['lr']:.2e})")
+        log("-" * 10)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
+
+        for phase in ['train', 'val']:
+            epoch_loss, epoch_acc, samples_per_sec = run_epoch(runner, dataloaders[phase], criterion, optimizer, device, args, phase, ddp)
+            log(f"{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} ({samples_per_sec:.1f} samples/s)")
 
-                    if phase == 'train':
-                        loss.backward()
-                        optimizer.step()
+            # Save Deep Save (metrics are already reduced, so every rank takes the same branch)
+            if phase == 'val':
+                if epoch_acc > best_acc + args.min_delta:
+                    best_acc = epoch_acc
+                    stale_epochs = 0
+                    if is_main_process():
+                        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+                        torch.save(model.state_dict(), args.output)
+                    log("💾 Model Saved!")
+                else:
+                    stale_epochs += 1
 
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
-            
-            epoch_loss = running_loss / dataset_sizes[phase]
-            epoch_acc = running_corrects.double() / dataset_sizes[phase]
+        if isinstance(scheduler, optim.lr_scheduler.ReduceLROnPlateau):
+            scheduler.step(epoch_acc)
+        elif scheduler is not None:
+            scheduler.step()
 
-            print(f"{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}")
+        stop_early = args.patience > 0 and stale_epochs >= args.patience
+        checkpoint_due = (epoch + 1) % args.checkpoint_every == 0 or epoch + 1 == args.epochs or stop_early
+        if checkpoint_due and is_main_process():
+            save_checkpoint(args, {
+                "epoch": epoch + 1,
+                "model": model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "scheduler": scheduler.state_dict() if scheduler is not None else None,
+                "rng": capture_rng_state(),
+                "best_acc": best_acc,
+                "stale_epochs": stale_epochs,
+                "args": vars(args),
+            })
 
-            # Save Deep Save
-            if phase == 'val' and epoch_acc > best_acc:
-                best_acc = epoch_acc
-                os.makedirs("ml/models", exist_ok=True)
-                torch.save(model.state_dict(), MODEL_SAVE_PATH)
-                print("💾 Model Saved!")
+        if stop_early:
+            log(f"⏹️ Early stopping: no val improvement for {stale_epochs} epochs")
+            break
 
-    print(f"\n🎉 Training Complete. Best Val Acc: {best_acc:.4f}")
+    log(f"\n🎉 Training Complete. Best Val Acc: {best_acc:.4f}")
+    if args.register and is_main_process() and os.path.exists(args.output):
+        arch = "multitask" if args.task == "multitask" else "resnet18"
+        meta = ModelRegistry().register(
+            args.output, arch,
+            backbone=args.backbone if args.task == "multitask" else None,
+            metrics={"val_acc": best_acc},
+            notes=f"train.py --task {args.task}, {args.epochs} epochs",
+        )
+        log(f"📦 Registered as model version {meta['version']} (activate with 'model_registry.py activate {meta['version']}')")
+    if dist.is_initialized():
+        dist.destroy_process_group()
 
 if __name__ == "__main__":
-    train_model()
+    train_model(parse_args())
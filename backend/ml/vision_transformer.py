@@ -2,11 +2,15 @@ import torch
 import torch.nn as nn
 import timm
 
+# Output names, in the order heads are evaluated
+HEADS = ("dr_grade", "diseases", "biological_age", "cardio_risk")
+HEAD_MODULES = {"dr_grade": "head_dr", "diseases": "head_disease", "biological_age": "head_age", "cardio_risk": "head_risk"}
+
 class RetiNetModel(nn.Module):
-    def __init__(self, model_name="vit_base_patch16_224", num_classes_dr=5, num_classes_disease=45):
+    def __init__(self, model_name="vit_base_patch16_224", num_classes_dr=5, num_classes_disease=45, pretrained=True):
         super(RetiNetModel, self).__init__()
-        # Load Pretrained Vision Transformer
-        self.backbone = timm.create_model(model_name, pretrained=True, num_classes=0) # Remove classification head
+        # Load Vision Transformer (ImageNet weights only when not about to load a trained checkpoint)
+        self.backbone = timm.create_model(model_name, pretrained=pretrained, num_classes=0) # Remove classification head
         
         # Input features size (768 for ViT-Base)
         self.num_features = self.backbone.num_features
@@ -43,20 +47,16 @@ class RetiNetModel(nn.Module):
             nn.Linear(256, 1)
         )
 
-    def forward(self, x):
+    def forward(self, x, heads=None, return_features=False):
+        """
+        Runs the shared backbone once and only the requested heads (all of them by default).
+        With `return_features` the pooled backbone output is included as "embedding".
+        """
         features = self.backbone(x)
-        
-        dr_out = self.head_dr(features)
-        disease_out = self.head_disease(features)
-        age_out = self.head_age(features)
-        risk_out = self.head_risk(features)
-        
-        return {
-            "dr_grade": dr_out,
-            "diseases": disease_out,
-            "biological_age": age_out,
-            "cardio_risk": risk_out
-        }
+        outputs = {name: getattr(self, HEAD_MODULES[name])(features) for name in (heads or HEADS)}
+        if return_features:
+            outputs["embedding"] = features
+        return outputs
 
 if __name__ == "__main__":
     # Test Instantiation
@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import torch
+import timm
+from ml.vision_transformer import RetiNetModel
+from model_registry import file_sha256
+
+# Artifacts produced by ml/export.py (paths relative to backend/, like WEIGHTS_PATH)
+ARTIFACT_DIR = "ml/models"
+ARTIFACT_FILES = {
+    "int8_static": "retinet_v1.int8.pt",
+    "torchscript": "retinet_v1.ts.pt",
+    "onnx": "retinet_v1.onnx",
+}
+ARTIFACT_SOURCE_SUFFIX = ".source.json"  # Sidecar naming the weights an artifact was exported from
+INPUT_SHAPE = (3, 224, 224)
+# timm backbone of the multi-task RetiNetModel; must match the one used by 'ml/train.py --task multitask'
+MULTITASK_BACKBONE = os.environ.get("RETINET_MT_BACKBONE", "vit_base_patch16_224")
+
+def build_fp32_model(weights_path, device="cpu"):
+    """Builds the fp32 resnet18 grader, loading trained weights when they exist."""
+    has_weights = os.path.exists(weights_path)
+    # Only fetch ImageNet weights when there is no trained checkpoint to overwrite them
+    fp32_model = timm.create_model('resnet18', pretrained=not has_weights, num_classes=5)
+
+    if has_weights:
+        fp32_model.load_state_dict(torch.load(weights_path, map_location=device))
+        print("✅ Trained Model Loaded Successfully!")
+    else:
+        print("⚠️ Warning: Trained weights not found. Running with pre-trained ImageNet weights.")
+
+    fp32_model.to(device)
+    fp32_model.eval()
+    return fp32_model
+
+def build_multitask_model(weights_path, device="cpu", backbone=None):
+    """Builds the multi-task RetiNetModel (DR, diseases, biological age, cardio risk heads)."""
+    has_weights = os.path.exists(weights_path)
+    mt_model = RetiNetModel(backbone or MULTITASK_BACKBONE, pretrained=not has_weights)
+
+    if has_weights:
+        mt_model.load_state_dict(torch.load(weights_path, map_location=device))
+        print("✅ Trained Multi-Task Model Loaded Successfully!")
+    else:
+        print("⚠️ Warning: Multi-task weights not found. Heads are untrained, outputs are meaningless.")
+
+    mt_model.to(device)
+    mt_model.eval()
+    return mt_model
+
+ARCHITECTURES = {
+    "resnet18": build_fp32_model,
+    "multitask": build_multitask_model,
+}
+
+def select_quantized_engine():
+    # x86 supersedes fbgemm on recent torch; qnnpack is the ARM fallback
+    supported = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in supported:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError(f"No quantized engine available (supported: {supported})")
+
+def write_artifact_source(artifact, weights_path):
+    """Records the content hash of the weights `artifact` was exported from."""
+    with open(f"{artifact}{ARTIFACT_SOURCE_SUFFIX}", "w") as f:
+        json.dump({"weights_sha256": file_sha256(weights_path), "weights": os.path.abspath(weights_path)}, f, indent=2)
+
+def artifact_matches(artifact, weights_path):
+    """True when `artifact` was exported from these exact weights (False for exports without a sidecar)."""
+    try:
+        with open(f"{artifact}{ARTIFACT_SOURCE_SUFFIX}") as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(weights_path) and source.get("weights_sha256") == file_sha256(weights_path)
+
+class OnnxRuntimeModel:
+    """Callable wrapper so an ONNX Runtime session can stand in for an nn.Module."""
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort  # Optional dependency, only needed for this backend
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, input_tensor):
+        outputs = self.session.run(None, {self.input_name: input_tensor.cpu().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def eval(self):
+        return self
+
+def _load_eager(weights_path, device, num_threads, build, artifact):
+    return build(weights_path, device)
+
+def _load_int8_dynamic(weights_path, device, num_threads, build, artifact):
+    select_quantized_engine()
+    fp32_model = build(weights_path, "cpu")
+    # Dynamic quantization only covers nn.Linear: just the fc head on resnet, but nearly all of a ViT
+    return torch.ao.quantization.quantize_dynamic(fp32_model, {torch.nn.Linear}, dtype=torch.qint8)
+
+def _load_int8_static(weights_path, device, num_threads, build, artifact):
+    select_quantized_engine()
+    return torch.jit.load(artifact, map_location="cpu").eval()
+
+def _load_torchscript(weights_path, device, num_threads, build, artifact):
+    scripted = torch.jit.load(artifact, map_location=device).eval()
+    return torch.jit.optimize_for_inference(scripted)
+
+def _load_compile(weights_path, device, num_threads, build, artifact):
+    # Compile the timm feature extractor in place rather than wrapping the model: forward(), the
+    # embedding path (forward_features + pre-logits pooling) and any head subset all run through
+    # it without a recompile per call signature. Compilation happens lazily during warm-up.
+    model = build(weights_path, device)
+    features = getattr(model, "backbone", model)
+    features.forward_features = torch.compile(features.forward_features)
+    return model
+
+def _load_onnx(weights_path, device, num_threads, build, artifact):
+    return OnnxRuntimeModel(artifact, num_threads)
+
+BACKENDS = {
+    "eager": _load_eager,
+    "int8_dynamic": _load_int8_dynamic,
+    "int8_static": _load_int8_static,
+    "torchscript": _load_torchscript,
+    "compile": _load_compile,
+    "onnx": _load_onnx,
+}
+# Backends that run on the CPU regardless of the detected device
+CPU_ONLY_BACKENDS = {"int8_dynamic", "int8_static", "onnx"}
+# Exported artifacts are DR-only resnet graphs; the multi-task model is served from its weights
+MULTITASK_BACKENDS = {"eager", "int8_dynamic", "compile"}
+
+def load_backend(name, weights_path, device, num_threads=None, arch="resnet18", artifact_dir=ARTIFACT_DIR, backbone=None):
+    """
+    Returns a callable mapping a (N, 3, 224, 224) float tensor to (N, 5) logits
+    (resnet18), or to a dict of head outputs (multitask, which also takes `heads=`).
+    Exported artifacts are looked up in `artifact_dir` (a registry version's directory).
+    Falls back to eager fp32 when the requested artifact has not been exported yet, or was
+    exported from other weights than `weights_path`.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown model architecture '{arch}'. Choose from: {', '.join(ARCHITECTURES)}")
+
+    if arch == "multitask" and name not in MULTITASK_BACKENDS:
+        print(f"⚠️ Warning: '{name}' is not available for the multi-task model. Falling back to eager fp32.")
+        name = "eager"
+
+    artifact = os.path.join(artifact_dir, ARTIFACT_FILES[name]) if name in ARTIFACT_FILES else None
+    if artifact and not os.path.exists(artifact):
+        print(f"⚠️ Warning: {artifact} not found (run ml/export.py). Falling back to eager fp32.")
+        name = "eager"
+    elif artifact and not artifact_matches(artifact, weights_path):
+        # A stale export would otherwise serve the old model under the new weights' model_version
+        print(f"⚠️ Warning: {artifact} was not exported from {weights_path} (re-run ml/export.py). Falling back to eager fp32.")
+        name = "eager"
+
+    build = ARCHITECTURES[arch]
+    if backbone and arch == "multitask":
+        build = functools.partial(build_multitask_model, backbone=backbone)
+
+    print(f"🔄 Loading '{name}' inference backend ({arch})...")
+    return BACKENDS[name](weights_path, device, num_threads, build, artifact)
@@ -0,0 +1,133 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+
+# Config
+REGISTRY_DIR = os.environ.get("RETINET_REGISTRY_DIR", "ml/models/registry")
+WEIGHTS_FILE = "model.pth"
+META_FILE = "meta.json"
+ACTIVE_FILE = "ACTIVE"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _write_atomic(path, text):
+    with open(f"{path}.part", "w") as f:
+        f.write(text)
+    os.replace(f"{path}.part", path)
+
+class ModelRegistry:
+    """
+    Versioned model artifacts on disk:
+
+        registry/<version>/model.pth    trained weights
+        registry/<version>/meta.json    arch, backbone, sha256, metrics, notes, created_at
+        registry/<version>/*.pt|.onnx   optional exported artifacts (ml/export.py --version <version>)
+        registry/ACTIVE                 version new server processes load, and running ones swap to
+    """
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def version_dir(self, version):
+        return os.path.join(self.root, version)
+
+    def weights_path(self, version):
+        return os.path.join(self.version_dir(version), WEIGHTS_FILE)
+
+    def get(self, version):
+        """Metadata of one version, or None when it isn't registered."""
+        meta_path = os.path.join(self.version_dir(version), META_FILE)
+        if "/" in version or "\\" in version or not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def list(self):
+        if not os.path.isdir(self.root):
+            return []
+        versions = [self.get(name) for name in os.listdir(self.root) if os.path.isdir(self.version_dir(name))]
+        return sorted(filter(None, versions), key=lambda meta: meta["created_at"], reverse=True)
+
+    def register(self, weights_path, arch="resnet18", version=None, backbone=None, metrics=None, notes=None):
+        """Copies weights into the registry. The version defaults to the weights' content hash."""
+        sha256 = file_sha256(weights_path)
+        version = version or sha256[:12]
+        if self.get(version) is not None:
+            raise ValueError(f"Model version '{version}' is already registered")
+
+        target_dir = self.version_dir(version)
+        os.makedirs(target_dir, exist_ok=True)
+        shutil.copyfile(weights_path, os.path.join(target_dir, WEIGHTS_FILE))
+
+        meta = {
+            "version": version,
+            "arch": arch,
+            "backbone": backbone,
+            "sha256": sha256,
+            "metrics": metrics or {},
+            "notes": notes,
+            "source": os.path.abspath(weights_path),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        # meta.json last: a version only becomes visible once its weights are fully copied
+        _write_atomic(os.path.join(target_dir, META_FILE), json.dumps(meta, indent=2))
+        return meta
+
+    def active_version(self):
+        path = os.path.join(self.root, ACTIVE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return f.read().strip() or None
+
+    def set_active(self, version):
+        if self.get(version) is None:
+            raise KeyError(f"Unknown model version '{version}'")
+        os.makedirs(self.root, exist_ok=True)
+        _write_atomic(os.path.join(self.root, ACTIVE_FILE), version)
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the on-disk RetiNet model registry.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    register = commands.add_parser("register", help="Add a weights file as a new version")
+    register.add_argument("weights")
+    register.add_argument("--arch", choices=["resnet18", "multitask"], default="resnet18")
+    register.add_argument("--backbone", default=None, help="timm backbone (multitask only)")
+    register.add_argument("--version", default=None, help="Default: first 12 hex digits of the weights' sha256")
+    register.add_argument("--notes", default=None)
+    register.add_argument("--activate", action="store_true", help="Also make it the active version")
+
+    commands.add_parser("list", help="Show registered versions")
+
+    activate = commands.add_parser("activate", help="Point ACTIVE at a version (running servers pick it up)")
+    activate.add_argument("version")
+
+    args = parser.parse_args()
+    registry = ModelRegistry()
+
+    if args.command == "register":
+        meta = registry.register(args.weights, args.arch, args.version, args.backbone, notes=args.notes)
+        print(f"📦 Registered {meta['version']} ({meta['arch']})")
+        if args.activate:
+            registry.set_active(meta["version"])
+            print(f"✅ Active version: {meta['version']}")
+    elif args.command == "list":
+        active = registry.active_version()
+        for meta in registry.list():
+            marker = "*" if meta["version"] == active else " "
+            print(f"{marker} {meta['version']:<20}{meta['arch']:<12}{meta['created_at'][:19]}  {json.dumps(meta['metrics'])}")
+    elif args.command == "activate":
+        registry.set_active(args.version)
+        print(f"✅ Active version: {args.version}")
+
+if __name__ == "__main__":
+    main()
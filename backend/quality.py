@@ -0,0 +1,86 @@
+import os
+import numpy as np
+from metrics import QUALITY_REJECTED
+
+# Config
+QUALITY_GATE = os.environ.get("RETINET_QUALITY_GATE", "1") == "1"
+ANALYSIS_SIZE = 256  # Longest edge the checks run at
+FIELD_LEVEL = 20  # Brightest channel above this = inside the illuminated fundus field
+MIN_FIELD_FRACTION = float(os.environ.get("RETINET_MIN_FIELD_FRACTION", 0.2))
+# Fundus frames clipped top and bottom by the sensor score down to ~0.9; full-frame photos are caught by their corners
+MIN_CIRCULARITY = float(os.environ.get("RETINET_MIN_CIRCULARITY", 0.8))
+MAX_CORNER_FILL = float(os.environ.get("RETINET_MAX_CORNER_FILL", 0.5))
+CORNER_SIZE = 0.1  # Corner squares, as a share of the shorter edge
+MIN_SHARPNESS = float(os.environ.get("RETINET_MIN_SHARPNESS", 8.0))
+MIN_BRIGHTNESS = float(os.environ.get("RETINET_MIN_BRIGHTNESS", 25))
+MAX_OVEREXPOSED = float(os.environ.get("RETINET_MAX_OVEREXPOSED", 0.25))
+
+class ImageQualityError(ValueError):
+    """An upload that would not give a gradable scan; `reason` is a short machine-readable code."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        QUALITY_REJECTED.inc(reason=reason)
+
+def _erode(mask):
+    # 4-neighbour erosion with array shifts (no scipy needed)
+    inner = mask.copy()
+    inner[1:, :] &= mask[:-1, :]
+    inner[:-1, :] &= mask[1:, :]
+    inner[:, 1:] &= mask[:, :-1]
+    inner[:, :-1] &= mask[:, 1:]
+    return inner
+
+def measure(rgb_image):
+    """
+    Cheap quality measurements of a PIL RGB image, on a copy downscaled to ANALYSIS_SIZE:
+      field_fraction  share of the frame inside the illuminated fundus field
+      circularity     overlap (IoU) of that field with a circle of the same area at its centroid
+      corner_fill     share of the four corner squares inside the field (a fundus field never reaches them)
+      sharpness       variance of the green-channel Laplacian inside the field
+      brightness      mean luminance inside the field
+      overexposed     share of the field with a saturated channel (usually red washing out first)
+    """
+    image = rgb_image.copy()
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(image, dtype=np.float32)
+
+    field = pixels.max(axis=2) > FIELD_LEVEL
+    area = int(field.sum())
+    metrics = {"field_fraction": area / field.size}
+    if area == 0:
+        return {**metrics, "circularity": 0.0, "corner_fill": 0.0, "sharpness": 0.0, "brightness": 0.0, "overexposed": 0.0}
+
+    rows, cols = np.nonzero(field)
+    yy, xx = np.ogrid[:field.shape[0], :field.shape[1]]
+    circle = (yy - rows.mean()) ** 2 + (xx - cols.mean()) ** 2 <= area / np.pi
+    metrics["circularity"] = float((field & circle).sum() / (field | circle).sum())
+    size = max(1, round(CORNER_SIZE * min(field.shape)))
+    corners = [field[:size, :size], field[:size, -size:], field[-size:, :size], field[-size:, -size:]]
+    metrics["corner_fill"] = float(np.mean(corners))
+
+    # Green carries the vessel contrast; eroding keeps the field's rim from counting as detail
+    green = pixels[:, :, 1]
+    laplacian = green[1:-1, :-2] + green[1:-1, 2:] + green[:-2, 1:-1] + green[2:, 1:-1] - 4 * green[1:-1, 1:-1]
+    inner = _erode(_erode(field))[1:-1, 1:-1]
+    metrics["sharpness"] = float(laplacian[inner].var()) if inner.any() else 0.0
+
+    inside = pixels[field]
+    metrics["brightness"] = float((inside @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).mean())
+    metrics["overexposed"] = float((inside.max(axis=1) >= 250).mean())
+    return metrics
+
+def check_quality(metrics):
+    """Raises ImageQualityError when measure()'s results say the image isn't worth a forward pass."""
+    if metrics["field_fraction"] < MIN_FIELD_FRACTION or metrics["circularity"] < MIN_CIRCULARITY:
+        raise ImageQualityError("not_fundus", f"Not a fundus photograph: no circular retinal field found (circularity {metrics['circularity']:.2f})")
+    if metrics["corner_fill"] > MAX_CORNER_FILL:
+        raise ImageQualityError("not_fundus", f"Not a fundus photograph: the frame is lit into its corners ({metrics['corner_fill']:.0%})")
+    if metrics["brightness"] < MIN_BRIGHTNESS:
+        raise ImageQualityError("underexposed", f"Image is too dark to grade (brightness {metrics['brightness']:.0f})")
+    if metrics["overexposed"] > MAX_OVEREXPOSED:
+        raise ImageQualityError("overexposed", f"Image is overexposed ({metrics['overexposed']:.0%} of the retina saturated)")
+    if metrics["sharpness"] < MIN_SHARPNESS:
+        raise ImageQualityError("blurry", f"Image is too blurry to grade (sharpness {metrics['sharpness']:.1f})")
+    return metrics
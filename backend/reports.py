@@ -0,0 +1,257 @@
+import hashlib
+import io
+import os
+import textwrap
+from collections import OrderedDict
+from PIL import Image
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.lib.utils import ImageReader
+
+# Bump whenever the layout below changes so cached PDFs and ETags are invalidated
+REPORT_TEMPLATE_VERSION = "2"
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("RETINET_REPORT_CACHE_MB", 64)) * 1024 * 1024
+# Scan fields that end up in the PDF; anything else changing must not bust the cache
+REPORT_FIELDS = ("patient_id", "patient_name", "timestamp", "diagnosis", "confidence", "biological_age", "cardiovascular_risk", "file_url")
+
+# Embedded scan is drawn at 300x225pt; 2x that keeps it sharp when printed
+THUMBNAIL_SIZE = (600, 450)
+
+# --- Static Sections (wrapped once at import instead of on every request) ---
+def _wrap_section(items):
+    return [(item_title, textwrap.wrap(item_desc, width=90)) for item_title, item_desc in items]
+
+# 1. Definitions
+DEFINITIONS = _wrap_section([
+    ("Diabetic Retinopathy (DR):", "The AI scans for \"red lesions\" like micro-bleeds or leaky vessels. It compares these patterns against a massive database to see if they match known signs of disease."),
+    ("Cardiovascular Risk:", "It measures the Arteriolar-Venular Ratio (AVR)—the thickness of your arteries compared to your veins. If arteries are too narrow, it signals high blood pressure risk."),
+    ("Biological Age:", "It calculates a \"Retinal Age Gap\". If your eye vessels look older than your actual age, it suggests your body is aging faster than the calendar says.")
+])
+
+# 2. Clinical Implications
+IMPLICATIONS = _wrap_section([
+   ("If High DR Risk:", "Indicates potential microvascular damage. Probability of proliferative retinopathy is high. Strong recommendation for immediate ophthalmological grading."),
+   ("If Elevated Cardio Risk:", "Arteriolar narrowing is a robust biomarker for systemic hypertension. Clinical correlation with blood pressure monitoring is prescribed."),
+   ("If Large Age Gap:", "Retinal vascular age exceeding chronological age correlates with oxidative stress. Suggests need for comprehensive metabolic screening.")
+])
+
+# 3. Dietary Recommendations
+DIET = _wrap_section([
+    ("Retinal Defense:", "Increase intake of leafy greens (Spinach, Kale) rich in Lutein and Zeaxanthin to support macular pigment density."),
+    ("Vascular Integrity:", "Omega-3 rich foods (Salmon, Walnuts) to reduce endothelial inflammation and support vessel flexibility."),
+    ("Antioxidant Support:", "Berries (Blueberries, Goji) and Citrus fruits for Vitamin C to strengthen micro-vessels.")
+])
+
+STATIC_SECTIONS = [
+    ("Understanding Your Results", DEFINITIONS),
+    ("Clinical Implications & Risk Assessment", IMPLICATIONS),
+    ("Recommended Lifestyle & Dietary Interventions", DIET),
+]
+
+def report_etag(scan):
+    """Strong ETag over the rendered fields and the template version."""
+    digest = hashlib.sha256(REPORT_TEMPLATE_VERSION.encode())
+    digest.update(str(scan.get("_id")).encode())
+    for field in REPORT_FIELDS:
+        digest.update(f"|{field}={scan.get(field)}".encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+def make_thumbnail(local_path):
+    """Downscales the stored upload so ReportLab embeds ~100 KB instead of the full-resolution original."""
+    with Image.open(local_path) as image:
+        image.draft("RGB", THUMBNAIL_SIZE)
+        thumb = image.convert("RGB")
+    thumb.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    thumb.save(buffer, format="JPEG", quality=85)
+    buffer.seek(0)
+    return ImageReader(buffer)
+
+def _define_static_forms(c, width, height):
+    # Header and footer are drawn once per document as form XObjects and referenced from every report page
+    c.beginForm("header")
+    c.setFillColorRGB(0.06, 0.3, 0.27) # Medical Teal
+    c.rect(0, height - 100, width, 100, fill=True, stroke=False)
+
+    c.setFillColorRGB(1, 1, 1) # White
+    c.setFont("Helvetica-Bold", 24)
+    c.drawString(50, height - 60, "RetiNet Pro")
+    c.setFont("Helvetica", 12)
+    c.drawString(50, height - 80, "Clinical Diagnostic Report")
+    c.endForm()
+
+    c.beginForm("footer")
+    c.setLineWidth(0.5)
+    c.setStrokeColorRGB(0.8, 0.8, 0.8)
+    c.line(50, 60, width - 50, 60)
+
+    c.setFont("Helvetica", 8)
+    c.setFillColorRGB(0.5, 0.5, 0.5)
+    # Disclaimer (Left)
+    c.drawString(50, 45, "Generated by RetiNet Pro AI System. Informational purpose only.")
+    c.drawString(50, 35, "This report does not constitute medical advice.")
+
+    # Physician (Right)
+    c.drawRightString(width - 50, 45, "Reviewing Physician: Karthi's AI Doctor")
+    c.drawRightString(width - 50, 35, "Verified Digital Signature")
+    c.endForm()
+
+def _print_section(c, title, items, start_y, height):
+    # Check for page break before section title
+    current_y = start_y
+
+    if current_y < 120:
+        c.showPage()
+        current_y = height - 50
+    c.setFillColorRGB(0.06, 0.3, 0.27) # Medical Green
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, current_y, title)
+    c.setFillColorRGB(0, 0, 0)
+
+    current_y -= 25
+
+    for item_title, wrapped_lines in items:
+        # Check for page break
+        if current_y < 100:
+            c.showPage()
+            current_y = height - 50
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(50, current_y, item_title)
+
+        c.setFont("Helvetica", 10)
+        desc_y = current_y - 15
+        for line in wrapped_lines:
+            c.drawString(50, desc_y, line)
+            desc_y -= 12
+
+        current_y = desc_y - 10
+
+    return current_y - 10 # Extra space after section
+
+def draw_report(c, scan):
+    """Draws one scan's report onto canvas `c`, ending with showPage()."""
+    width, height = letter
+
+    # --- Header ---
+    c.doForm("header")
+
+    # --- Patient Info ---
+    c.setFillColorRGB(0, 0, 0) # Black
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, height - 140, "Patient Details")
+
+    c.setFont("Helvetica", 12)
+    y = height - 170
+    c.drawString(50, y, f"ID: {scan.get('patient_id', 'Unknown')}")
+    c.drawString(50, y - 20, f"Name: {scan.get('patient_name', 'Unknown')}")
+    c.drawString(50, y - 40, f"Date: {scan['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
+
+    # --- Diagnosis Result ---
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(50, y - 80, "AI Diagnostic Analysis")
+
+    c.setFont("Helvetica", 12)
+    diag_grade = scan['diagnosis']
+    confidence = f"{scan['confidence']*100:.1f}%"
+
+    # Color coding text based on severity (Simulated by drawing simplified text)
+    c.drawString(50, y - 110, f"Condition: {diag_grade}")
+    c.drawString(50, y - 130, f"Confidence: {confidence}")
+    c.drawString(50, y - 150, f"Biological Age Est: {scan.get('biological_age', '--')} Years")
+    c.drawString(50, y - 170, f"Cardio Risk: {scan.get('cardiovascular_risk', '--')}")
+
+    # --- Image Evidence ---
+    # Extract filename from URL (http://localhost:8000/uploads/xyz.jpg -> uploads/xyz.jpg)
+    local_path = scan['file_url'].replace("http://localhost:8000/", "")
+
+    if os.path.exists(local_path):
+        img = make_thumbnail(local_path)
+        # Draw Image centered
+        img_width = 300
+        img_height = 225
+        c.drawImage(img, (width - img_width)/2, y - 425, width=img_width, height=img_height, preserveAspectRatio=True)
+
+        c.setFont("Helvetica-Oblique", 9)
+        c.setFillColorRGB(0.3, 0.3, 0.3)
+        c.drawCentredString(width/2, y - 440, "Figure 1: Analyzed Retinal Fundus Scan")
+        curr_y = y - 480
+    else:
+        curr_y = y - 200 # If no image, start higher
+
+    # --- Glossary / Educational Section ---
+    for title, items in STATIC_SECTIONS:
+        curr_y = _print_section(c, title, items, curr_y, height)
+
+    # --- Footer ---
+    c.doForm("footer")
+    c.showPage()
+
+def render_report(scan):
+    """Renders a single-scan PDF and returns its bytes (runs in a report worker process)."""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    _define_static_forms(c, *letter)
+    draw_report(c, scan)
+    c.save()
+    return buffer.getvalue()
+
+def render_merged_report(scans, path):
+    """Renders several scans into one PDF file at `path` (runs in a report worker process)."""
+    c = canvas.Canvas(path, pagesize=letter)
+    # Header/footer forms are defined once and shared by every report in the document
+    _define_static_forms(c, *letter)
+    for scan in scans:
+        draw_report(c, scan)
+    c.save()
+    return path
+
+def report_filename(scan):
+    return f"{scan['timestamp']:%Y%m%d_%H%M%S}_{scan.get('patient_id', 'Unknown')}_{scan['_id']}.pdf"
+
+class ZipStream(io.RawIOBase):
+    """Write-only sink for zipfile that hands back bytes as soon as they are written, so archives can be streamed."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+class ReportCache:
+    """LRU of rendered PDFs keyed by ETag, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes=REPORT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag):
+        pdf = self.entries.get(etag)
+        if pdf is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(etag)
+        self.hits += 1
+        return pdf
+
+    def put(self, etag, pdf):
+        if len(pdf) > self.max_bytes or etag in self.entries:
+            return
+        self.entries[etag] = pdf
+        self.size += len(pdf)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
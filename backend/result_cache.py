@@ -0,0 +1,112 @@
+import datetime
+import os
+from collections import OrderedDict
+
+# Config
+CACHE_MAX_ENTRIES = int(os.environ.get("RETINET_CACHE_MAX_ENTRIES", 10000))
+CACHE_USE_MONGO = os.environ.get("RETINET_CACHE_MONGO", "0") == "1"
+CACHE_TTL_DAYS = int(os.environ.get("RETINET_CACHE_TTL_DAYS", 30))
+
+class ResultCache:
+    """
+    Maps (image content hash, model version) to a previous prediction (the result
+    dict from inference.predict_batch, holding whichever heads have been run).
+
+    An in-memory LRU bounded by `max_entries` sits in front of an optional Mongo
+    collection, so repeat uploads survive restarts and are shared between workers.
+    Entries from any other model version are never returned: `set_model_version()`
+    drops them from memory and from Mongo whenever the served weights change.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, collection=None):
+        self.max_entries = max(0, int(max_entries))
+        self.collection = collection
+        self.model_version = None
+        self.entries = OrderedDict()
+
+        # Stats
+        self.hits = 0
+        self.mongo_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def create_indexes(self):
+        if self.collection is None:
+            return
+        await self.collection.create_index("created_at", expireAfterSeconds=CACHE_TTL_DAYS * 86400)
+        await self.collection.create_index("model_version")
+
+    async def set_model_version(self, model_version):
+        if model_version == self.model_version:
+            return
+        if self.model_version is not None:
+            self.invalidations += 1
+        self.model_version = model_version
+        self.entries.clear()
+        if self.collection is not None:
+            await self.collection.delete_many({"model_version": {"$ne": model_version}})
+
+    def _key(self, image_hash):
+        return f"{image_hash}:{self.model_version}"
+
+    async def get(self, image_hash):
+        if self.model_version is None:
+            return None
+
+        key = self._key(image_hash)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.collection is not None:
+            doc = await self.collection.find_one({"_id": key}, {"_id": 0, "created_at": 0})
+            if doc:
+                self.mongo_hits += 1
+                value = doc
+                self._remember(key, value)
+                return value
+
+        self.misses += 1
+        return None
+
+    async def put(self, image_hash, result):
+        # Results from a model that has since been swapped out (or not yet swapped in) aren't cached
+        if self.model_version is None or result.get("model_version", self.model_version) != self.model_version:
+            return
+
+        key = self._key(image_hash)
+        value = dict(result)
+        self._remember(key, value)
+
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {**value, "model_version": self.model_version, "created_at": datetime.datetime.now(datetime.timezone.utc)}},
+                upsert=True,
+            )
+
+    def _remember(self, key, value):
+        if self.max_entries == 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.mongo_hits + self.misses
+        return {
+            "model_version": self.model_version,
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "mongo_backed": self.collection is not None,
+            "hits": self.hits,
+            "mongo_hits": self.mongo_hits,
+            "misses": self.misses,
+            "hit_rate": ((self.hits + self.mongo_hits) / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,133 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# Config
+WORKERS = int(os.environ.get("RETINET_WORKERS", 2))
+HOST = os.environ.get("RETINET_HOST", "0.0.0.0")
+PORT = int(os.environ.get("RETINET_PORT", 8000))
+RESTART_DELAY_SECONDS = 1.0
+
+def bind_socket(host, port):
+    """One listening socket shared by every worker; the kernel hands each connection to whichever accepts first."""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def preload_model():
+    """
+    Loads the served model in the parent so forked workers share its weights copy-on-write.
+    Returns False when the backend can't survive fork() and every worker has to load its own.
+    """
+    import torch
+    import inference
+
+    if inference.device.type != "cpu" or inference.INFERENCE_BACKEND == "onnx":
+        # CUDA contexts and onnxruntime's thread pool don't survive fork()
+        print(f"⚠️ Warning: '{inference.INFERENCE_BACKEND}' on {inference.device} can't be shared across workers; each worker loads its own copy.")
+        return False
+
+    # No forward pass and a single thread: an OpenMP pool started before fork() deadlocks the children
+    torch.set_num_threads(1)
+    inference.activate(inference.load_startup_model())
+    print(f"📦 Loaded {inference.model_version} once, shared by all workers")
+    return True
+
+def worker_cores(index, workers, pin):
+    if not pin or not hasattr(os, "sched_getaffinity"):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    share = max(1, len(cores) // workers)
+    return set(cores[(index * share) % len(cores):][:share])
+
+def run_worker(sock, cores, log_level):
+    if cores:
+        os.sched_setaffinity(0, cores)
+    import uvicorn
+
+    # main.py picks up the preloaded model (inference.get_served) and sets this worker's torch threads on startup
+    server = uvicorn.Server(uvicorn.Config("main:app", log_level=log_level))
+    server.run(sockets=[sock])
+
+def spawn(index, sock, args):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # Worker process: uvicorn installs its own shutdown handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        run_worker(sock, worker_cores(index, args.workers, args.pin_cores), args.log_level)
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        os._exit(code)
+
+def main():
+    parser = argparse.ArgumentParser(description="Production launcher: loads the model once, then forks uvicorn workers that share it.")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--pin-cores", action="store_true", help="Give each worker its own slice of CPU cores (Linux)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("❌ serve.py needs fork() (Linux/macOS). On Windows run a single 'uvicorn main:app' process.")
+
+    # Read by inference.py at import, so the parent and every worker agree; workers x threads = cores avoids oversubscription
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+    os.environ["RETINET_TORCH_THREADS"] = str(threads)
+
+    sock = bind_socket(args.host, args.port)
+    preload_model()
+    # Keep the collector from touching (and so copying) every object loaded so far in each worker
+    gc.collect()
+    gc.freeze()
+
+    print(f"🚀 Starting {args.workers} workers x {threads} torch threads on http://{args.host}:{args.port}")
+    workers = {spawn(index, sock, args): index for index in range(args.workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: a crashed worker is re-forked from the parent, so it shares the weights again
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"⚠️ Worker {index} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting")
+        time.sleep(RESTART_DELAY_SECONDS)
+        workers[spawn(index, sock, args)] = index
+
+    sock.close()
+    print("⏹️ All workers stopped")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Config
+EMBEDDINGS_ENABLED = os.environ.get("RETINET_EMBEDDINGS", "1") == "1"
+EMBEDDING_DIR = os.environ.get("RETINET_EMBEDDING_DIR", "embeddings")
+IVF_MIN_TRAIN = int(os.environ.get("RETINET_IVF_MIN_TRAIN", 20000))  # Exact search below this many scans
+IVF_NPROBE = int(os.environ.get("RETINET_IVF_NPROBE", 8))  # Lists scanned per query; higher = better recall, slower
+IVF_TRAIN_SAMPLE = 50000
+IVF_ITERATIONS = 10
+META_FILE = "meta.json"
+RECORDS_FILE = "records.bin"
+CENTROIDS_FILE = "centroids.npz"
+TRAIN_LOCK_FILE = "train.lock"
+TRAIN_LOCK_STALE_SECONDS = 3600  # A lock this old was left by a worker that died mid-training
+
+def _record_dtype(dim):
+    return np.dtype([("scan_id", "S24"), ("image_hash", "S64"), ("vector", "<f2", (dim,))])
+
+def assign(vectors, centroids, chunk_size=8192):
+    """Nearest centroid (by inner product, vectors are unit length) of each row."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size].astype(np.float32)
+        labels[start:start + chunk_size] = (chunk @ centroids.T).argmax(axis=1)
+    return labels
+
+def train_centroids(vectors, n_lists, iterations=IVF_ITERATIONS, seed=0):
+    """Spherical k-means over unit vectors."""
+    rng = np.random.default_rng(seed)
+    vectors = vectors.astype(np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+    for _ in range(iterations):
+        labels = assign(vectors, centroids)
+        counts = np.bincount(labels, minlength=n_lists)
+        order = np.argsort(labels, kind="stable")
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+
+        sums = vectors[rng.choice(len(vectors), n_lists)]  # Empty lists are re-seeded from random vectors
+        sums[filled] = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+class EmbeddingIndex:
+    """
+    Penultimate-layer embeddings of graded scans for one model version, with an inverted-file
+    (IVF) index for approximate nearest-neighbour search by cosine similarity:
+
+        <dir>/meta.json       model version and embedding size
+        <dir>/records.bin     append-only (scan id, image hash, float16 unit vector) records
+        <dir>/centroids.npz   IVF list centroids and the list of each row at training time,
+                              trained once IVF_MIN_TRAIN scans are stored
+        <dir>/train.lock      held by the one worker (re)training the centroids
+
+    Every record is one append, so several worker processes can share a directory; each
+    picks up the others' records (and retrained centroids) on its next add or search.
+    Training runs in a background thread, so add() stays one append.
+    """
+
+    def __init__(self, directory, model_version, dim):
+        self.directory = directory
+        self.dim = dim
+        self.dtype = _record_dtype(dim)
+        self.records_path = os.path.join(directory, RECORDS_FILE)
+        self.centroids_path = os.path.join(directory, CENTROIDS_FILE)
+        self.train_lock_path = os.path.join(directory, TRAIN_LOCK_FILE)
+        self.lock = threading.Lock()
+        self.training = False
+
+        self.vectors = np.empty((1024, dim), dtype=np.float16)  # Grown by doubling
+        self.size = 0
+        self.scan_ids = []
+        self.rows = {}
+        self.rows_by_hash = {}
+        self.offset = 0  # Bytes of records.bin already loaded
+
+        self.centroids = None
+        self.centroids_mtime = None
+        self.trained_size = 0
+        self.lists = None
+
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"model_version": model_version, "dim": dim}, f)
+
+    def _append(self, records):
+        needed = self.size + len(records)
+        if needed > len(self.vectors):
+            grown = np.empty((max(needed, 2 * len(self.vectors)), self.dim), dtype=np.float16)
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size:needed] = records["vector"]
+
+        scan_ids = records["scan_id"].astype(str).tolist()
+        self.scan_ids.extend(scan_ids)
+        self.rows.update(zip(scan_ids, range(self.size, needed)))
+        self.rows_by_hash.update(zip(records["image_hash"].astype(str).tolist(), range(self.size, needed)))
+        if self.lists is not None:
+            for row, label in enumerate(assign(records["vector"], self.centroids), start=self.size):
+                self.lists[label].append(row)
+        self.size = needed
+
+    def _load_centroids(self):
+        with np.load(self.centroids_path) as data:
+            self.centroids = data["centroids"]
+            self.trained_size = int(data["trained_size"])
+            labels = data["labels"][:self.size]
+        # Rows appended since training still need their nearest list
+        labels = np.concatenate([labels, assign(self.vectors[len(labels):self.size], self.centroids)])
+        order = np.argsort(labels, kind="stable")
+        bounds = np.cumsum(np.bincount(labels, minlength=len(self.centroids)))[:-1]
+        self.lists = [rows.tolist() for rows in np.split(order, bounds)]
+
+    def refresh(self):
+        """Loads records and centroids written since the last call, by this process or another worker."""
+        total = os.path.getsize(self.records_path) if os.path.exists(self.records_path) else 0
+        # Only whole records: another worker may be mid-append
+        complete = (total - self.offset) // self.dtype.itemsize * self.dtype.itemsize
+        if complete > 0:
+            with open(self.records_path, "rb") as f:
+                f.seek(self.offset)
+                self._append(np.frombuffer(f.read(complete), dtype=self.dtype))
+            self.offset += complete
+
+        if os.path.exists(self.centroids_path):
+            mtime = os.path.getmtime(self.centroids_path)
+            if mtime != self.centroids_mtime:
+                self._load_centroids()
+                self.centroids_mtime = mtime
+
+    def vector_for_hash(self, image_hash):
+        with self.lock:
+            self.refresh()
+            row = self.rows_by_hash.get(image_hash)
+            return None if row is None else self.vectors[row].copy()
+
+    def _needs_training(self):
+        return self.size >= IVF_MIN_TRAIN and self.size >= 4 * self.trained_size
+
+    def _train_lock_held(self):
+        try:
+            return time.time() - os.path.getmtime(self.train_lock_path) < TRAIN_LOCK_STALE_SECONDS
+        except OSError:
+            return False
+
+    def _acquire_train_lock(self):
+        """Cross-process: O_EXCL creation succeeds in exactly one worker."""
+        if os.path.exists(self.train_lock_path) and not self._train_lock_held():
+            try:
+                os.remove(self.train_lock_path)
+            except OSError:
+                pass
+        try:
+            os.close(os.open(self.train_lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def add(self, scan_id, image_hash, vector):
+        record = np.zeros(1, dtype=self.dtype)
+        record["scan_id"] = scan_id
+        record["image_hash"] = image_hash
+        record["vector"] = vector
+        with self.lock:
+            # O_APPEND: one write per record keeps concurrent workers' records whole
+            with open(self.records_path, "ab") as f:
+                f.write(record.tobytes())
+            self.refresh()
+            retrain = self._needs_training() and not self.training and not self._train_lock_held()
+            if retrain:
+                self.training = True
+        if retrain:
+            # Not a daemon: a script exiting right after its last add still finishes (and unlocks)
+            threading.Thread(target=self._train, name="ivf-train", daemon=False).start()
+
+    def _train(self):
+        # Searches keep using the previous lists (or exact search) meanwhile
+        try:
+            if not self._acquire_train_lock():
+                return  # Another worker is training; its centroids arrive on a later refresh
+            try:
+                with self.lock:
+                    self.refresh()  # Another worker may have just finished training
+                    if not self._needs_training():
+                        return
+                    sample = self.vectors[np.random.default_rng().choice(self.size, min(self.size, IVF_TRAIN_SAMPLE), replace=False)]
+                    trained_size = self.size
+                    vectors = self.vectors[:self.size]  # Rows never change, so a view is safe after the lock
+
+                centroids = train_centroids(sample, max(16, int(2 * np.sqrt(trained_size))))
+                # Saved with the centroids so other workers and restarts don't redo the assignment
+                temp_path = f"{self.centroids_path}.part.npz"
+                np.savez(temp_path, centroids=centroids, trained_size=trained_size, labels=assign(vectors, centroids))
+                os.replace(temp_path, self.centroids_path)
+                with self.lock:
+                    self.refresh()
+                print(f"🗂️ Trained {len(centroids)} IVF lists over {trained_size} embeddings in {self.directory}")
+            finally:
+                os.remove(self.train_lock_path)
+        finally:
+            self.training = False
+
+    def search_scan(self, scan_id, k=10):
+        """Top-k (scan id, cosine similarity) for a stored scan, best first; None if it isn't indexed."""
+        with self.lock:
+            self.refresh()
+            row = self.rows.get(scan_id)
+            if row is None:
+                return None
+            query = self.vectors[row].astype(np.float32)
+
+            if self.lists is None:
+                candidates = np.arange(self.size)
+            else:
+                probe = np.argsort(-(self.centroids @ query))[:IVF_NPROBE]
+                candidates = np.fromiter((r for label in probe for r in self.lists[label]), dtype=np.int64)
+            candidates = candidates[candidates != row]
+            scores = self.vectors[candidates].astype(np.float32) @ query
+
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            return [(self.scan_ids[candidates[i]], float(scores[i])) for i in top]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(model_version, dim=None):
+    """
+    The index for `model_version` (embeddings of different models aren't comparable).
+    Created on first add (`dim` given); None when nothing was ever stored for that version.
+    """
+    with _indexes_lock:
+        index = _indexes.get(model_version)
+        if index is None:
+            directory = os.path.join(EMBEDDING_DIR, model_version)
+            meta_path = os.path.join(directory, META_FILE)
+            if os.path.exists(meta_path):
+                with open(meta_path) as f:
+                    dim = json.load(f)["dim"]
+            elif dim is None:
+                return None
+            index = _indexes[model_version] = EmbeddingIndex(directory, model_version, dim)
+        return index
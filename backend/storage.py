@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import os
+import uuid
+import zipfile
+from PIL import Image
+
+# Config
+UPLOAD_DIR = "uploads"
+UPLOAD_TMP_DIR = "uploads_tmp"  # Outside the StaticFiles mount so partial uploads are never served
+MAX_UPLOAD_BYTES = int(os.environ.get("RETINET_MAX_UPLOAD_MB", 25)) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = int(os.environ.get("RETINET_UPLOAD_CHUNK_KB", 256)) * 1024
+MAX_ARCHIVE_BYTES = int(os.environ.get("RETINET_MAX_ARCHIVE_MB", 2048)) * 1024 * 1024
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+# Originals under uploads/<aa>/<bb>/<hash>.<ext> instead of one flat folder (new uploads only; stored URLs keep working)
+SHARDED_UPLOADS = os.environ.get("RETINET_SHARDED_UPLOADS", "0") == "1"
+# WebP derivatives written next to each original: longest edge in px
+DERIVATIVE_SIZES = {
+    "thumb": int(os.environ.get("RETINET_THUMB_PX", 256)),
+    "medium": int(os.environ.get("RETINET_MEDIUM_PX", 1024)),
+}
+DERIVATIVE_QUALITY = int(os.environ.get("RETINET_WEBP_QUALITY", 80))
+
+os.makedirs(UPLOAD_DIR, exist_ok=True)
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+class UploadTooLarge(Exception):
+    pass
+
+def _discard(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def _commit(temp_path, final_path):
+    # Identical bytes are already stored under the same hash name, keep a single copy
+    if os.path.exists(final_path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(temp_path, final_path)
+
+def discard_upload(filename):
+    """Deletes a stored original (blocking). Only for uploads no scan points to."""
+    _discard(os.path.join(UPLOAD_DIR, filename))
+
+def stored_name(image_hash, extension):
+    """Path of an original relative to UPLOAD_DIR (and to /uploads/ in URLs)."""
+    if SHARDED_UPLOADS:
+        return f"{image_hash[:2]}/{image_hash[2:4]}/{image_hash}{extension}"
+    return f"{image_hash}{extension}"
+
+def derivative_name(filename, kind):
+    return f"{os.path.splitext(filename)[0]}_{kind}.webp"
+
+def make_derivatives(filename):
+    """
+    Writes the WebP derivatives (DERIVATIVE_SIZES) of a stored original next to it.
+    Names follow the original's content hash, so existing derivatives are never redone.
+    Blocking; runs as a background task after the response is sent.
+    """
+    todo = {kind: size for kind, size in DERIVATIVE_SIZES.items()
+            if not os.path.exists(os.path.join(UPLOAD_DIR, derivative_name(filename, kind)))}
+    if not todo:
+        return
+
+    with Image.open(os.path.join(UPLOAD_DIR, filename)) as image:
+        # JPEG only: decode at a reduced DCT scale that still covers the largest derivative
+        image.draft("RGB", (max(todo.values()), max(todo.values())))
+        image = image.convert("RGB")
+
+    # Largest first, each smaller size is downscaled from the one before
+    for kind, size in sorted(todo.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        temp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+        image.save(temp_path, format="WEBP", quality=DERIVATIVE_QUALITY, method=4)
+        _commit(temp_path, os.path.join(UPLOAD_DIR, derivative_name(filename, kind)))
+
+async def stream_to_temp(file, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_BYTES):
+    """
+    Streams an UploadFile to a temp file chunk by chunk, hashing as it goes.
+    Memory use is bounded by `chunk_size`; file I/O runs in worker threads.
+    Returns (temp path, sha256 hex digest).
+    """
+    temp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+    size = 0
+
+    out = await asyncio.to_thread(open, temp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+        if size == 0:
+            raise ValueError("Uploaded file is empty")
+    except BaseException:
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(_discard, temp_path)
+        raise
+    await asyncio.to_thread(out.close)
+    return temp_path, digest.hexdigest()
+
+async def save_upload(file, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_BYTES):
+    """Stores an uploaded image under its content hash. Returns (sha256 hex digest, stored filename)."""
+    extension = os.path.splitext(file.filename or "")[1].lower() or ".jpg"
+    temp_path, image_hash = await stream_to_temp(file, max_bytes, chunk_size)
+
+    filename = stored_name(image_hash, extension)
+    await asyncio.to_thread(_commit, temp_path, os.path.join(UPLOAD_DIR, filename))
+    return image_hash, filename
+
+def extract_archive_images(archive_path, max_member_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_BYTES):
+    """
+    Copies every image inside a zip archive into UPLOAD_DIR under its content hash,
+    one member at a time (blocking, call from a worker thread).
+    Returns (stored, skipped): lists of (member basename, sha256, filename) and (member name, reason).
+    """
+    stored, skipped = [], []
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            basename = os.path.basename(name)
+            extension = os.path.splitext(basename)[1].lower()
+
+            if info.is_dir() or not basename or basename.startswith(".") or name.startswith("__MACOSX/"):
+                continue
+            if extension not in IMAGE_EXTENSIONS:
+                skipped.append((name, "not an image"))
+                continue
+            # file_size is the declared uncompressed size, so this also guards against zip bombs
+            if info.file_size > max_member_bytes:
+                skipped.append((name, f"exceeds the {max_member_bytes // (1024 * 1024)} MB limit"))
+                continue
+
+            temp_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.part")
+            digest = hashlib.sha256()
+            with archive.open(info) as src, open(temp_path, "wb") as out:
+                for chunk in iter(lambda: src.read(chunk_size), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+
+            image_hash = digest.hexdigest()
+            filename = stored_name(image_hash, extension)
+            _commit(temp_path, os.path.join(UPLOAD_DIR, filename))
+            stored.append((basename, image_hash, filename))
+    return stored, skipped
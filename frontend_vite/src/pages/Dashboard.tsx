@@ -34,6 +34,9 @@ export default function Dashboard() {
             if (data.results.diabetic_retinopathy && !data.results.diabetic_retinopathy.is_normal) {
                 setShowHeatmap(true);
             }
+        } else if (data && data.detail && data.detail.reason) {
+            // Rejected by the backend's image-quality gate (blurry, overexposed, not a fundus photo)
+            alert(`Scan rejected: ${data.detail.message}`);
         } else if (img && !data) {
             // Handle raw upload from file input
             // Need to initiate fetch here similar to SmartViewfinder
@@ -60,6 +63,12 @@ export default function Dashboard() {
                     });
                 })
                 .then(res => {
+                    if (res.status === 422) {
+                        return res.json().then(body => {
+                            alert(`Scan rejected: ${body.detail.message}`);
+                            return {};
+                        });
+                    }
                     if (!res.ok) throw new Error("Server Error");
                     return res.json();
                 })
@@ -316,8 +325,8 @@ export default function Dashboard() {
 
                             <MetricCard
                                 title="BIOLOGICAL AGE"
-                                value={results ? `${results.biological_age.predicted} Years` : "-- Years"}
-                                trend={results ? `+${results.biological_age.gap} Gap` : "--"}
+                                value={results?.biological_age.predicted != null ? `${results.biological_age.predicted} Years` : "-- Years"}
+                                trend={results?.biological_age.predicted != null ? `+${results.biological_age.gap} Gap` : "--"}
                                 description="Retinal vasculature analysis."
                                 icon={Calendar}
                                 color="text-blue-500"
@@ -325,7 +334,7 @@ export default function Dashboard() {
                             />
                             <MetricCard
                                 title="CARDIOVASCULAR"
-                                value={results ? results.cardiovascular_risk : "--"}
+                                value={results?.cardiovascular_risk ?? "--"}
                                 description="Arteriolar-venular ratio (AVR) analysis."
                                 icon={Heart}
                                 color="text-rose-500"
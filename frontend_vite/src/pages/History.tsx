@@ -7,12 +7,24 @@ import { Download, Search } from 'lucide-react';
 //    const navigate = useNavigate();
 export default function History() {
     const [scans, setScans] = useState<any[]>([]);
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
 
-    useEffect(() => {
-        fetch('http://localhost:8000/history')
-            .then(res => res.json())
-            .then(data => setScans(data))
+    // Keyset pagination: the backend returns the cursor for the next page in X-Next-Cursor
+    const loadPage = (cursor: string | null) => {
+        const url = cursor
+            ? `http://localhost:8000/history?cursor=${encodeURIComponent(cursor)}`
+            : 'http://localhost:8000/history';
+        fetch(url)
+            .then(res => {
+                setNextCursor(res.headers.get('X-Next-Cursor'));
+                return res.json();
+            })
+            .then(data => setScans(prev => cursor ? [...prev, ...data] : data))
             .catch(err => console.error("History fetch error:", err));
+    };
+
+    useEffect(() => {
+        loadPage(null);
     }, []);
 
     return (
@@ -53,7 +65,14 @@ export default function History() {
                                     <tr key={scan._id} className="hover:bg-medical-light/10 transition group">
                                         <td className="px-6 py-4">
                                             <div className="w-12 h-12 rounded-lg bg-gray-100 overflow-hidden border border-gray-200">
-                                                <img src={scan.file_url} className="w-full h-full object-cover" alt="Retina" />
+                                                {/* WebP thumbnail made at upload; older scans (or one still being generated) fall back to the original */}
+                                                <img
+                                                    src={scan.thumb_url || scan.file_url}
+                                                    onError={(e) => { if (e.currentTarget.src !== scan.file_url) e.currentTarget.src = scan.file_url; }}
+                                                    loading="lazy"
+                                                    className="w-full h-full object-cover"
+                                                    alt="Retina"
+                                                />
                                             </div>
                                         </td>
                                         <td className="px-6 py-4 text-sm font-medium">
@@ -90,6 +109,16 @@ export default function History() {
                             </tbody>
                         </table>
                     </div>
+                    {nextCursor && (
+                        <div className="flex justify-center mt-6">
+                            <button
+                                onClick={() => loadPage(nextCursor)}
+                                className="px-6 py-2 rounded-full border border-medical-teal text-medical-teal text-sm font-bold hover:bg-medical-light/30 transition"
+                            >
+                                Load older scans
+                            </button>
+                        </div>
+                    )}
                 </div>
             </div>
         </div>